@@ -3,37 +3,68 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.schemas.token import TokenData
-from app import crud
-from app.database import AsyncSessionLocal
+from app.schemas import user as user_schema
+from app import crud, models
+from app.database import get_db
 from app.core.config import settings
+from app.core.user_cache import user_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token")
 
-async def get_db():
 
-    async with AsyncSessionLocal() as session:
-        yield session
-
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
-    
+        raise _credentials_exception()
+    return payload
+
+
+async def _cached_user(payload: dict, db: AsyncSession) -> user_schema.User:
+    email = payload["sub"]
+    user = user_cache.get(email)
+    if user is None:
+        db_user = await crud.get_user_by_email(db, email=email)
+        if db_user is None:
+            raise _credentials_exception()
+        user = user_schema.User.model_validate(db_user)
+        user_cache.set(email, user)
+    return user
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> user_schema.User:
+    """Текущий пользователь из кэша (снимок `schemas.User`); БД читается только при промахе."""
+    return await _cached_user(_decode_token(token), db)
+
+
+async def get_current_user_from_claims(token: str = Depends(oauth2_scheme),
+                                       db: AsyncSession = Depends(get_db)) -> user_schema.User:
+    """
+    Для эндпоинтов только для чтения: при AUTH_TRUST_TOKEN_CLAIMS пользователь
+    собирается из подписанных полей токена без обращения к БД. Токены без `uid`
+    (выданные до его появления) проверяются как обычно.
+    """
+    payload = _decode_token(token)
+    if settings.AUTH_TRUST_TOKEN_CLAIMS and "uid" in payload:
+        return user_schema.User(id=payload["uid"], email=payload["sub"])
+    return await _cached_user(payload, db)
+
 
-    user = await crud.get_user_by_email(db, email=token_data.email)
-    
+async def get_current_db_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> models.User:
+    """ORM-пользователь из текущей сессии, всегда из БД — для изменения профиля и пароля."""
+    payload = _decode_token(token)
+    user = await crud.get_user_by_email(db, email=payload["sub"])
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
@@ -0,0 +1,38 @@
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class GenerationProfile(BaseModel):
+    """
+    Параметры генерации Ollama для одного сценария: ограничение длины ответа,
+    размер контекста, температура, стоп-последовательности и время удержания модели.
+    None — значение по умолчанию сервера Ollama (для keep_alive — OLLAMA_KEEP_ALIVE).
+    """
+    num_predict: Optional[int] = None
+    num_ctx: Optional[int] = None
+    temperature: Optional[float] = None
+    stop: List[str] = []
+    keep_alive: Optional[str] = None
+
+    def options(self) -> Dict[str, Any]:
+        options = self.model_dump(exclude={"keep_alive", "stop"}, exclude_none=True)
+        if self.stop:
+            options["stop"] = self.stop
+        return options
+
+
+# Размер контекста одинаков во всех профилях намеренно: при смене num_ctx Ollama
+# перезагружает модель, и переключение между сценариями стоило бы секунд.
+DEFAULT_NUM_CTX = 4096
+
+DEFAULT_GENERATION_PROFILES: Dict[str, GenerationProfile] = {
+    "promo": GenerationProfile(num_predict=900, num_ctx=DEFAULT_NUM_CTX, temperature=0.8),
+    "document": GenerationProfile(num_predict=1500, num_ctx=DEFAULT_NUM_CTX, temperature=0.3),
+    "tool_selection": GenerationProfile(num_predict=256, num_ctx=DEFAULT_NUM_CTX, temperature=0.0),
+    "rag_answer": GenerationProfile(num_predict=512, num_ctx=DEFAULT_NUM_CTX, temperature=0.2,
+                                    stop=["\nВОПРОС:", "\nКОНТЕКСТ:"]),
+    "analytics": GenerationProfile(num_predict=400, num_ctx=DEFAULT_NUM_CTX, temperature=0.3),
+    "smart_plan": GenerationProfile(num_predict=1200, num_ctx=DEFAULT_NUM_CTX, temperature=0.5),
+    "default": GenerationProfile(num_predict=1024, num_ctx=DEFAULT_NUM_CTX),
+}
@@ -1,37 +1,359 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
 import ollama
 from loguru import logger
 from app.core.config import settings
+from app.core.generation_profiles import GenerationProfile
+from app.core.llm_scheduler import LLMOverloadedError, LLMScheduler, llm_scheduler
+from app.core.ollama_pool import OllamaPool
+
+
+class LLMResponseCache:
+    """
+    Двухуровневый кэш ответов LLM: LRU в памяти процесса и, опционально, SQLite на диске.
+    Ключ — хэш от (модель, промпт, формат, опции), поэтому одинаковые запросы
+    возвращаются без повторного обращения к Ollama.
+    """
+    def __init__(self, max_entries: int, sqlite_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._hits: Counter = Counter()
+        self._misses: Counter = Counter()
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            logger.info(f"Дисковый кэш LLM подключен: {sqlite_path}")
+
+    @staticmethod
+    def make_key(model: str, prompt: str, format: str, options: Optional[Dict[str, Any]] = None) -> str:
+        raw = json.dumps([model, prompt, format, options or {}], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, str]]:
+        with self._db_lock:
+            row = self._db.execute("SELECT expires_at, value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        return row
+
+    def _disk_set(self, key: str, value: str, expires_at: float):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str, use_case: str) -> Optional[str]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry and entry[0] > now:
+            self._memory.move_to_end(key)
+            self._hits[use_case] += 1
+            return entry[1]
+        self._memory.pop(key, None)
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._disk_get, key)
+            if row and row[0] > now:
+                self._remember(key, row[1], row[0])
+                self._hits[use_case] += 1
+                return row[1]
+
+        self._misses[use_case] += 1
+        return None
+
+    async def set(self, key: str, value: str, ttl: int):
+        expires_at = time.time() + ttl
+        self._remember(key, value, expires_at)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        use_cases = set(self._hits) | set(self._misses)
+        return {
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "disk_enabled": self._db is not None,
+            "use_cases": {
+                name: {"hits": self._hits[name], "misses": self._misses[name]}
+                for name in sorted(use_cases)
+            },
+        }
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы: пока запрос с данным ключом
+    выполняется, остальные вызывающие ждут тот же результат, а не ставят
+    в очередь Ollama N одинаковых генераций.
+    """
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Помечает исключение как полученное, даже если все ожидающие были отменены.
+            task.exception()
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+            logger.info("Идентичный запрос к LLM уже выполняется, ожидание его результата.")
+        # shield: отмена одного из ожидающих не должна прерывать общий запрос.
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls), "coalesced": self.coalesced}
+
 
 class LLMClient:
     """
     Асинхронный клиент для взаимодействия с сервером Ollama.
     """
-    def __init__(self, model: str, host: str):
+    def __init__(self, model: str, pool: OllamaPool, scheduler: LLMScheduler, cache: Optional[LLMResponseCache] = None):
         self.model = model
+        self.scheduler = scheduler
+        self.cache = cache
+        self.inflight = SingleFlight()
+
+        self.pool = pool
+        logger.info(f"LLM-клиент инициализирован для модели '{self.model}' на хостах: {', '.join(pool.hosts)}")
+
+    def _connection_error(self, e: Exception) -> ConnectionError:
+        logger.error(f"Ошибка при взаимодействии с Ollama: {e}")
+        return ConnectionError(f"Не удалось связаться с сервером Ollama. Убедитесь, что он запущен и доступен по адресу {', '.join(self.pool.hosts)}. Ошибка: {e}")
+
+    @staticmethod
+    def _profile(use_case: str) -> GenerationProfile:
+        profiles = settings.LLM_GENERATION_PROFILES
+        return profiles.get(use_case) or profiles.get("default") or GenerationProfile()
 
-        self.client = ollama.AsyncClient(host=host)
-        logger.info(f"LLM-клиент инициализирован для модели '{self.model}' на хосте '{host}'")
+    def _flight_key(self, prompt: str, format: str, use_case: str, system: Optional[str]) -> str:
+        # Параметры генерации входят в ключ: ответы с разными лимитами и температурой не взаимозаменяемы.
+        return LLMResponseCache.make_key(
+            self.model, prompt, format, {"system": system, "options": self._profile(use_case).options()}
+        )
 
-    async def generate_json_response(self, prompt: str) -> str:
+    def _cache_lookup_params(self, prompt: str, format: str, use_case: str,
+                             system: Optional[str] = None) -> Tuple[Optional[str], int]:
+        ttl = settings.LLM_CACHE_TTL.get(use_case, settings.LLM_CACHE_TTL.get("default", 0))
+        if self.cache is None or ttl <= 0:
+            return None, 0
+        return self._flight_key(prompt, format, use_case, system), ttl
+
+    @staticmethod
+    def _is_cacheable(text: str, format: str, validate: Optional[Callable[[str], bool]]) -> bool:
         """
-        Отправляет промпт в Ollama и запрашивает ответ в формате JSON.
-        Возвращает строковое представление JSON ответа.
+        В кэш попадает только ответ, который вызывающий код сможет разобрать, иначе
+        ошибочный ответ возвращался бы на каждый повтор до истечения TTL.
         """
-        logger.info(f"Отправка промпта в модель '{self.model}'...")
-        logger.debug(f"ПРОМПТ:\n---\n{prompt}\n---")
-
+        if not text.strip():
+            return False
         try:
-            response = await self.client.generate(
+            if validate is not None:
+                return bool(validate(text))
+            if format == 'json':
+                json.loads(text)
+        except Exception:
+            return False
+        return True
+
+    def _request(self, client: ollama.AsyncClient, prompt: str, format: str, system: Optional[str], stream: bool,
+                 use_case: str, options: Optional[Dict[str, Any]] = None):
+        """
+        Формирует запрос к Ollama. С системным сообщением используется chat-режим:
+        неизменный системный промпт дает одинаковый префикс, и Ollama переиспользует
+        его KV-кэш вместо повторного вычисления на каждом запросе.
+        Лимиты и параметры генерации берутся из профиля сценария `use_case`.
+        """
+        profile = self._profile(use_case)
+        options = {**profile.options(), **(options or {})}
+        keep_alive = profile.keep_alive or settings.OLLAMA_KEEP_ALIVE
+        if system:
+            return client.chat(
                 model=self.model,
-                prompt=prompt,
-                format='json',
-                stream=False
+                messages=[{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+                format=format,
+                options=options,
+                keep_alive=keep_alive,
+                stream=stream,
             )
-            logger.info("Ответ от LLM получен успешно.")
-            return response['response']
-        except Exception as e:
-            logger.error(f"Ошибка при взаимодействии с Ollama: {e}")
-            raise ConnectionError(f"Не удалось связаться с сервером Ollama. Убедитесь, что он запущен и доступен по адресу {self.client._client.host}. Ошибка: {e}")
+        return client.generate(
+            model=self.model,
+            prompt=prompt,
+            format=format,
+            options=options,
+            keep_alive=keep_alive,
+            stream=stream,
+        )
+
+    @staticmethod
+    def _response_text(part) -> str:
+        return part['message']['content'] if 'message' in part else part['response']
+
+    async def _call_model(self, prompt: str, format: str, use_case: str, user_id: Optional[int],
+                          system: Optional[str] = None) -> str:
+        async with self.scheduler.slot(use_case, user_id):
+            logger.info(f"Отправка промпта в модель '{self.model}'...")
+            logger.debug(f"ПРОМПТ:\n---\n{prompt}\n---")
+
+            try:
+                response = await self.pool.call(
+                    lambda client: self._request(client, prompt, format, system, stream=False, use_case=use_case)
+                )
+                logger.info("Ответ от LLM получен успешно.")
+                return self._response_text(response)
+            except Exception as e:
+                raise self._connection_error(e)
+
+    async def _generate(self, prompt: str, format: str = '', use_case: str = "default",
+                        user_id: Optional[int] = None, system: Optional[str] = None,
+                        validate: Optional[Callable[[str], bool]] = None) -> str:
+        cache_key, ttl = self._cache_lookup_params(prompt, format, use_case, system)
+        if cache_key:
+            cached = await self.cache.get(cache_key, use_case)
+            if cached is not None:
+                logger.info(f"Ответ LLM для '{use_case}' взят из кэша.")
+                return cached
+
+        async def call() -> str:
+            result = await self._call_model(prompt, format, use_case, user_id, system)
+            if cache_key:
+                if self._is_cacheable(result, format, validate):
+                    await self.cache.set(cache_key, result, ttl)
+                else:
+                    logger.warning(f"Ответ LLM для '{use_case}' не прошел проверку и не сохранен в кэш.")
+            return result
+
+        flight_key = cache_key or self._flight_key(prompt, format, use_case, system)
+        try:
+            return await self.inflight.do(flight_key, call)
+        except LLMOverloadedError as e:
+            if e.user_key is None or e.user_key == self.scheduler.user_key(user_id):
+                raise
+            # Объединенный запрос отклонен по лимиту другого пользователя (того, кто его начал);
+            # на этого пользователя отказ не распространяется — он встает в очередь сам.
+            return await call()
+
+    async def generate_json_response(self, prompt: str, use_case: str = "default",
+                                     user_id: Optional[int] = None, system: Optional[str] = None,
+                                     validate: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Отправляет промпт в Ollama и запрашивает ответ в формате JSON.
+        Возвращает строковое представление JSON ответа.
+        Постоянные инструкции лучше передавать в `system`, а не склеивать с промптом.
+        Кэшируется только ответ, прошедший `validate` (по умолчанию — `json.loads`).
+        """
+        return await self._generate(prompt, format='json', use_case=use_case, user_id=user_id, system=system,
+                                    validate=validate)
+
+    async def generate_text(self, prompt: str, use_case: str = "default", user_id: Optional[int] = None,
+                            system: Optional[str] = None, validate: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Отправляет промпт в Ollama и возвращает ответ в виде обычного текста.
+        Пустой ответ или не прошедший `validate` не кэшируется.
+        """
+        response = await self._generate(prompt, use_case=use_case, user_id=user_id, system=system,
+                                        validate=validate)
+        return response.strip()
+
+    async def stream_response(self, prompt: str, format: Optional[str] = None, use_case: str = "default",
+                              user_id: Optional[int] = None, system: Optional[str] = None,
+                              validate: Optional[Callable[[str], bool]] = None) -> AsyncIterator[str]:
+        """
+        Отправляет промпт в Ollama в потоковом режиме и отдает фрагменты ответа
+        по мере их генерации моделью. При попадании в кэш ответ отдается одним фрагментом.
+        Правила кэширования те же, что у `generate_json_response`/`generate_text`.
+        """
+        cache_key, ttl = self._cache_lookup_params(prompt, format or '', use_case, system)
+        if cache_key:
+            cached = await self.cache.get(cache_key, use_case)
+            if cached is not None:
+                logger.info(f"Ответ LLM для '{use_case}' взят из кэша.")
+                yield cached
+                return
+
+        parts = []
+        async with self.scheduler.slot(use_case, user_id):
+            logger.info(f"Отправка промпта в модель '{self.model}' (stream)...")
+            logger.debug(f"ПРОМПТ:\n---\n{prompt}\n---")
+
+            try:
+                stream = self.pool.stream(
+                    lambda client: self._request(client, prompt, format or '', system, stream=True, use_case=use_case)
+                )
+                async for part in stream:
+                    chunk = self._response_text(part)
+                    if chunk:
+                        parts.append(chunk)
+                        yield chunk
+                logger.info("Потоковый ответ от LLM получен успешно.")
+            except Exception as e:
+                raise self._connection_error(e)
+
+        result = "".join(parts)
+        if cache_key and self._is_cacheable(result, format or '', validate):
+            await self.cache.set(cache_key, result, ttl)
+
+    async def warm_up_prefix(self, system: str, use_case: str):
+        """
+        Прогревает KV-кэш системного промпта на каждом узле пула: модель загружается
+        (и остается в памяти на OLLAMA_KEEP_ALIVE), а префикс вычисляется заранее,
+        так что первый запрос пользователя не платит за его обработку. Профиль
+        `use_case` должен совпадать с рабочими запросами: другой num_ctx перезагрузил бы модель.
+        """
+        async def warm(node):
+            try:
+                await self._request(node.client, "", '', system, stream=False, use_case=use_case,
+                                    options={"num_predict": 1})
+                logger.info(f"Системный промпт прогрет на узле Ollama {node.host}.")
+            except Exception as e:
+                logger.warning(f"Не удалось прогреть системный промпт на узле Ollama {node.host}: {e}")
+
+        await asyncio.gather(*(warm(node) for node in self.pool.nodes if node.healthy))
+
+
+llm_cache = LLMResponseCache(
+    max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+    sqlite_path=settings.LLM_CACHE_SQLITE_PATH,
+) if settings.LLM_CACHE_ENABLED else None
 
+ollama_pool = OllamaPool(
+    hosts=settings.OLLAMA_HOSTS or [settings.OLLAMA_HOST],
+    health_check_interval=settings.OLLAMA_HEALTH_CHECK_INTERVAL,
+    health_check_timeout=settings.OLLAMA_HEALTH_CHECK_TIMEOUT,
+)
 
-llm_client = LLMClient(model=settings.OLLAMA_MODEL, host=settings.OLLAMA_HOST)
+llm_client = LLMClient(
+    model=settings.OLLAMA_MODEL,
+    pool=ollama_pool,
+    scheduler=llm_scheduler,
+    cache=llm_cache,
+)
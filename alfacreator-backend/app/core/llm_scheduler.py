@@ -0,0 +1,177 @@
+import asyncio
+import math
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from fastapi import HTTPException, status
+from loguru import logger
+
+from app.core.config import settings
+
+
+class LLMOverloadedError(HTTPException):
+    """
+    Очередь к LLM переполнена. Возвращается клиенту как 429 (превышен лимит
+    пользователя) или 503 (переполнена очередь класса) с заголовком Retry-After.
+    """
+    def __init__(self, status_code: int, detail: str, retry_after: int, user_key: Any = None):
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+        # Для 429 — пользователь, чей лимит превышен; для 503 — None (перегрузка общая).
+        self.user_key = user_key
+
+
+class LLMScheduler:
+    """
+    Ограничивает число одновременных генераций в Ollama и распределяет
+    свободные слоты по приоритетам сценариев. Внутри одного приоритета
+    пользователи обслуживаются по кругу, чтобы один пользователь с пачкой
+    запросов не занимал всю очередь.
+    """
+    def __init__(self, max_in_flight: int, max_queue_depth: int, max_queued_per_user: int,
+                 priorities: Dict[str, int]):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue_depth = max_queue_depth
+        self.max_queued_per_user = max_queued_per_user
+        self.priorities = priorities
+
+        self._in_flight = 0
+        self._queues: Dict[int, "OrderedDict[Any, Deque[asyncio.Future]]"] = {}
+        self._queued_per_user: Counter = Counter()
+        self._rejected = 0
+        # Скользящее среднее длительности генерации, используется для Retry-After.
+        self._avg_service_time = 10.0
+
+    @staticmethod
+    def user_key(user_id: Optional[int]) -> Any:
+        return user_id if user_id is not None else "anonymous"
+
+    def _priority(self, use_case: str) -> int:
+        return self.priorities.get(use_case, self.priorities.get("default", 0))
+
+    def _queue_depth(self, priority: Optional[int] = None) -> int:
+        queues = [self._queues.get(priority, {})] if priority is not None else self._queues.values()
+        return sum(len(waiters) for queue in queues for waiters in queue.values())
+
+    def _retry_after(self) -> int:
+        waiting = self._queue_depth() + self._in_flight
+        return max(1, math.ceil(waiting / self.max_in_flight * self._avg_service_time))
+
+    def _check_limits(self, priority: int, user_key: Any):
+        if self._queued_per_user[user_key] >= self.max_queued_per_user:
+            self._rejected += 1
+            raise LLMOverloadedError(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "Слишком много одновременных запросов к AI. Дождитесь завершения предыдущих.",
+                self._retry_after(),
+                user_key,
+            )
+        if self._queue_depth(priority) >= self.max_queue_depth:
+            self._rejected += 1
+            raise LLMOverloadedError(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "AI-сервис перегружен. Попробуйте повторить запрос позже.",
+                self._retry_after(),
+            )
+
+    def _enqueue(self, priority: int, user_key: Any) -> asyncio.Future:
+        self._check_limits(priority, user_key)
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(priority, OrderedDict()).setdefault(user_key, deque()).append(future)
+        self._queued_per_user[user_key] += 1
+        return future
+
+    def _discard(self, priority: int, user_key: Any, future: asyncio.Future):
+        queue = self._queues.get(priority, {})
+        waiters = queue.get(user_key)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del queue[user_key]
+            self._queued_per_user[user_key] -= 1
+
+    def _pop_next(self) -> Optional[asyncio.Future]:
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            user_key, waiters = next(iter(queue.items()))
+            future = waiters.popleft()
+            if waiters:
+                queue.move_to_end(user_key)
+            else:
+                del queue[user_key]
+            self._queued_per_user[user_key] -= 1
+            return future
+        return None
+
+    def _dispatch(self):
+        while self._in_flight < self.max_in_flight:
+            future = self._pop_next()
+            if future is None:
+                return
+            if future.cancelled():
+                continue
+            self._in_flight += 1
+            future.set_result(None)
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def check_admission(self, use_case: str, user_id: Optional[int] = None):
+        """
+        Бросает LLMOverloadedError, если запрос сейчас был бы отклонен. Потоковые
+        эндпоинты вызывают ее до отправки заголовков, чтобы перегрузка вернулась
+        статусом 429/503 с Retry-After, а не событием `error` внутри ответа 200.
+        """
+        if self._in_flight < self.max_in_flight and not self._queue_depth():
+            return
+        self._check_limits(self._priority(use_case), self.user_key(user_id))
+
+    @asynccontextmanager
+    async def slot(self, use_case: str, user_id: Optional[int] = None) -> AsyncIterator[None]:
+        """Занимает слот генерации на время выполнения блока."""
+        priority = self._priority(use_case)
+        user_key = self.user_key(user_id)
+
+        if self._in_flight < self.max_in_flight and not self._queue_depth():
+            self._in_flight += 1
+        else:
+            future = self._enqueue(priority, user_key)
+            logger.info(f"Запрос '{use_case}' поставлен в очередь к LLM (в очереди: {self._queue_depth()}).")
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Слот уже был выдан, но ожидающий отменен — возвращаем его.
+                    self._release()
+                else:
+                    self._discard(priority, user_key, future)
+                raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * elapsed
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": {str(priority): self._queue_depth(priority) for priority in sorted(self._queues)},
+            "rejected": self._rejected,
+            "avg_service_time": round(self._avg_service_time, 2),
+        }
+
+
+llm_scheduler = LLMScheduler(
+    max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+    max_queue_depth=settings.LLM_MAX_QUEUE_DEPTH,
+    max_queued_per_user=settings.LLM_MAX_QUEUED_PER_USER,
+    priorities=settings.LLM_PRIORITIES,
+)
@@ -0,0 +1,136 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+import httpx
+import ollama
+from loguru import logger
+
+# Ошибки соединения, при которых запрос можно безопасно повторить на другом узле.
+RETRYABLE_ERRORS = (httpx.TransportError, ConnectionError)
+
+
+class OllamaNode:
+    def __init__(self, host: str, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.host = host.rstrip("/")
+        self.client = ollama.AsyncClient(host=self.host, transport=transport)
+        self.outstanding = 0
+        self.healthy = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {"host": self.host, "healthy": self.healthy, "outstanding": self.outstanding}
+
+
+class OllamaPool:
+    """
+    Пул серверов Ollama. Запрос отправляется на здоровый узел с наименьшим
+    числом активных запросов; при ошибке соединения узел помечается
+    недоступным, а запрос повторяется на следующем. Недоступные узлы
+    возвращаются в работу фоновой проверкой `/api/tags`.
+    `transport` (httpx) подменяет сетевой уровень, например заглушками серверов в тестах.
+    """
+    def __init__(self, hosts: List[str], health_check_interval: float, health_check_timeout: float,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        if not hosts:
+            raise ValueError("Не задан ни один хост Ollama")
+        self.nodes = [OllamaNode(host, transport) for host in hosts]
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self._transport = transport
+        self._health_task: Optional[asyncio.Task] = None
+
+    @property
+    def hosts(self) -> List[str]:
+        return [node.host for node in self.nodes]
+
+    def _pick(self, exclude: Set[OllamaNode]) -> Optional[OllamaNode]:
+        candidates = [node for node in self.nodes if node not in exclude]
+        healthy = [node for node in candidates if node.healthy]
+        # Если здоровых узлов не осталось, пробуем остальные: проверка могла устареть.
+        pool = healthy or candidates
+        if not pool:
+            return None
+        return min(pool, key=lambda node: node.outstanding)
+
+    def _mark_unhealthy(self, node: OllamaNode, error: Exception):
+        if node.healthy:
+            logger.warning(f"Узел Ollama {node.host} исключен из балансировки: {error}")
+        node.healthy = False
+
+    @asynccontextmanager
+    async def _use(self, node: OllamaNode) -> AsyncIterator[OllamaNode]:
+        node.outstanding += 1
+        try:
+            yield node
+        finally:
+            node.outstanding -= 1
+
+    async def call(self, request: Callable[[ollama.AsyncClient], Awaitable[Any]]) -> Any:
+        """Выполняет запрос на наименее загруженном узле, повторяя его на других при сбое соединения."""
+        tried: Set[OllamaNode] = set()
+        while True:
+            node = self._pick(tried)
+            if node is None:
+                raise ConnectionError(f"Все узлы Ollama недоступны: {', '.join(self.hosts)}")
+            tried.add(node)
+            try:
+                async with self._use(node):
+                    return await request(node.client)
+            except RETRYABLE_ERRORS as e:
+                self._mark_unhealthy(node, e)
+
+    async def stream(self, request: Callable[[ollama.AsyncClient], Awaitable[AsyncIterator[Any]]]) -> AsyncIterator[Any]:
+        """
+        Потоковый вариант `call`. Повтор на другом узле возможен только до
+        получения первого фрагмента, иначе клиент увидел бы ответ дважды.
+        """
+        tried: Set[OllamaNode] = set()
+        while True:
+            node = self._pick(tried)
+            if node is None:
+                raise ConnectionError(f"Все узлы Ollama недоступны: {', '.join(self.hosts)}")
+            tried.add(node)
+            started = False
+            try:
+                async with self._use(node):
+                    async for part in await request(node.client):
+                        started = True
+                        yield part
+                return
+            except RETRYABLE_ERRORS as e:
+                self._mark_unhealthy(node, e)
+                if started:
+                    raise
+
+    async def _probe(self, http: httpx.AsyncClient, node: OllamaNode):
+        try:
+            response = await http.get(f"{node.host}/api/tags")
+            response.raise_for_status()
+        except Exception as e:
+            self._mark_unhealthy(node, e)
+            return
+        if not node.healthy:
+            logger.info(f"Узел Ollama {node.host} снова доступен.")
+        node.healthy = True
+
+    async def _health_loop(self):
+        async with httpx.AsyncClient(timeout=self.health_check_timeout, transport=self._transport) as http:
+            while True:
+                await asyncio.gather(*(self._probe(http, node) for node in self.nodes))
+                await asyncio.sleep(self.health_check_interval)
+
+    def start_health_checks(self):
+        if self._health_task is None and self.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [node.stats() for node in self.nodes]
@@ -0,0 +1,81 @@
+import asyncio
+import multiprocessing
+import resource
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+
+
+class JobLimitExceeded(Exception):
+    """Задача в пуле процессов превысила лимит времени или памяти."""
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _init_worker(memory_limit_mb: int):
+    if memory_limit_mb > 0:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _on_alarm(signum, frame):
+    raise JobLimitExceeded("Превышено время обработки файла.")
+
+
+def _run_with_limits(fn: Callable[..., Any], time_limit: int, *args, **kwargs) -> Any:
+    # Выполняется внутри процесса-воркера: SIGALRM прерывает зависшую задачу,
+    # а сам процесс остается в пуле для следующих задач.
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.alarm(time_limit)
+    try:
+        return fn(*args, **kwargs)
+    except MemoryError:
+        raise JobLimitExceeded("Недостаточно памяти для обработки файла.")
+    finally:
+        signal.alarm(0)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, а не fork: родительский процесс держит потоки (torch, chromadb, event loop).
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.DATAFRAME_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(settings.DATAFRAME_JOB_MEMORY_LIMIT_MB,),
+        )
+        logger.info(f"Пул процессов для DataFrame запущен ({settings.DATAFRAME_PROCESS_WORKERS} воркеров).")
+    return _executor
+
+
+async def run_in_process(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Выполняет CPU-тяжелую функцию (разбор и агрегацию DataFrame) в пуле процессов,
+    не блокируя event loop. Функция и аргументы должны быть сериализуемы pickle.
+    """
+    global _executor
+    time_limit = settings.DATAFRAME_JOB_TIMEOUT_SECONDS
+    job = partial(_run_with_limits, fn, time_limit, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_executor(), job)
+    except BrokenProcessPool:
+        # Воркер был убит (например, OOM killer) — пересоздаем пул для следующих задач.
+        logger.error("Пул процессов для DataFrame поврежден и будет пересоздан.")
+        _executor = None
+        raise JobLimitExceeded("Процесс обработки файла аварийно завершился.")
+
+
+def shutdown_process_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,40 @@
+import json
+from typing import Any, AsyncIterator, Dict, Tuple
+
+from fastapi.responses import StreamingResponse
+from loguru import logger
+
+StreamEvent = Tuple[str, Dict[str, Any]]
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Сериализует одно событие в формат Server-Sent Events."""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def _encode_events(events: AsyncIterator[StreamEvent]) -> AsyncIterator[str]:
+    try:
+        async for event, data in events:
+            yield format_sse(event, data)
+    except Exception as e:
+        # Заголовки уже отправлены, поэтому ошибку можно передать только отдельным событием.
+        logger.error(f"Ошибка во время потоковой генерации: {e}", exc_info=True)
+        yield format_sse("error", {"detail": str(e)})
+
+
+def sse_response(events: AsyncIterator[StreamEvent]) -> StreamingResponse:
+    """
+    Оборачивает асинхронный генератор событий `(event, data)` в SSE-ответ.
+    Клиент получает события `token` по мере генерации и финальное `done`
+    с полным результатом (или `error`).
+    """
+    return StreamingResponse(
+        _encode_events(events),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Отключает буферизацию ответа в nginx, иначе токены придут одним куском.
+            "X-Accel-Buffering": "no",
+        },
+    )
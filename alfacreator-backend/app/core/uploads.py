@@ -0,0 +1,98 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.config import settings
+
+UPLOAD_DIR = "temp_uploads"
+# Запас на границы multipart и текстовые поля формы сверх самого файла.
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+
+@dataclass
+class StoredUpload:
+    path: Optional[str]
+    size: int
+    sha256: str
+
+
+def _max_upload_bytes() -> int:
+    return settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+
+
+def _too_large_detail() -> str:
+    return f"Файл слишком большой. Максимальный размер — {settings.MAX_UPLOAD_SIZE_MB} МБ."
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=_too_large_detail())
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Отклоняет multipart-запросы с Content-Length больше лимита до разбора формы:
+    FastAPI читает тело (и сбрасывает файл во временный файл) раньше зависимостей,
+    поэтому проверка в обработчике уже не экономит ни диск, ни время запроса.
+    Тела без Content-Length (chunked) ограничиваются позже, в `_consume`.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            headers = dict(scope["headers"])
+            content_type = headers.get(b"content-type", b"")
+            content_length = headers.get(b"content-length", b"")
+            if (content_type.startswith(b"multipart/form-data") and content_length.isdigit()
+                    and int(content_length) > _max_upload_bytes() + MULTIPART_OVERHEAD_BYTES):
+                response = JSONResponse(status_code=413, content={"detail": _too_large_detail()},
+                                        headers={"Connection": "close"})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+async def _consume(upload: UploadFile, out_file=None) -> StoredUpload:
+    max_bytes = _max_upload_bytes()
+    # Повторная проверка для тел без Content-Length: размер уже известен после разбора multipart.
+    if upload.size is not None and upload.size > max_bytes:
+        raise _too_large()
+
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := await upload.read(settings.UPLOAD_CHUNK_SIZE_BYTES):
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large()
+        digest.update(chunk)
+        if out_file is not None:
+            await out_file.write(chunk)
+    return StoredUpload(path=None, size=size, sha256=digest.hexdigest())
+
+
+async def save_upload(upload: UploadFile, file_path: str) -> StoredUpload:
+    """
+    Записывает загруженный файл на диск фрагментами фиксированного размера,
+    попутно считая SHA-256. В памяти одновременно находится не больше одного фрагмента.
+    """
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    try:
+        async with aiofiles.open(file_path, 'wb') as out_file:
+            stored = await _consume(upload, out_file)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    stored.path = file_path
+    return stored
+
+
+async def hash_upload(upload: UploadFile) -> StoredUpload:
+    """Проверяет размер и считает SHA-256 файла, не сохраняя его."""
+    return await _consume(upload)
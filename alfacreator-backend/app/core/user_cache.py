@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.core.config import settings
+from app.schemas import user as user_schema
+
+
+class UserCache:
+    """
+    LRU-кэш аутентифицированных пользователей с TTL, ключ — `sub` токена (email).
+    Хранит неизменяемые снимки `schemas.User`, а не ORM-объекты: они не привязаны
+    к сессии и не содержат хэш пароля. Для изменений пользователь всегда читается из БД.
+    """
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, user_schema.User]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, subject: str) -> Optional[user_schema.User]:
+        entry = self._entries.get(subject)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[subject]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(subject)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, subject: str, user: user_schema.User):
+        if self.ttl <= 0:
+            return
+        self._entries[subject] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(subject)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *subjects: str):
+        for subject in subjects:
+            self._entries.pop(subject, None)
+
+
+user_cache = UserCache(
+    ttl_seconds=settings.AUTH_USER_CACHE_TTL_SECONDS,
+    max_entries=settings.AUTH_USER_CACHE_MAX_ENTRIES,
+)
@@ -1,36 +1,78 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from . import models
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from app.schemas import user as user_schema
-from app.schemas import history as history_schema
 from app.core.security import get_password_hash
 
 
-async def create_history_entry(db: AsyncSession, user_id: int, entry: history_schema.HistoryCreate):
-    db_entry = models.History(
-        **entry.model_dump(),
-        user_id=user_id
-    )
-    db.add(db_entry)
+async def _insert_history_rows(db: AsyncSession, rows: List[Dict[str, Any]], payloads: List[Dict[str, Any]]):
+    if payloads:
+        digests = [payload["digest"] for payload in payloads]
+        existing = set((await db.execute(
+            select(models.HistoryPayload.digest).where(models.HistoryPayload.digest.in_(digests))
+        )).scalars())
+        new_payloads = [payload for payload in payloads if payload["digest"] not in existing]
+        if new_payloads:
+            await db.execute(insert(models.HistoryPayload), new_payloads)
+    await db.execute(insert(models.History), rows)
     await db.commit()
-    await db.refresh(db_entry)
-    return db_entry
 
 
-async def get_history_entries(db: AsyncSession, user_id: int, request_type: Optional[str] = None, skip: int = 0, limit: int = 20):
-    query = (
-        select(models.History)
-        .where(models.History.user_id == user_id)
+async def create_history_entries(db: AsyncSession, rows: List[Dict[str, Any]],
+                                 payloads: List[Dict[str, Any]] = ()):
+    """
+    Пакетная вставка записей истории одной транзакцией, без чтения строк обратно.
+    `payloads` — сжатое содержимое, на которое ссылаются записи; одинаковое
+    содержимое хранится один раз, поэтому уже сохраненные хеши пропускаются.
+    """
+    try:
+        await _insert_history_rows(db, rows, payloads)
+    except IntegrityError:
+        # Тот же хеш мог успеть вставить другой процесс; повторная проверка его уже увидит.
+        await db.rollback()
+        await _insert_history_rows(db, rows, payloads)
+
+
+async def get_history_entry(db: AsyncSession, user_id: int, entry_id: int):
+    result = await db.execute(
+        select(models.History).where(models.History.id == entry_id, models.History.user_id == user_id)
     )
+    return result.scalars().first()
+
+
+async def get_history_payloads(db: AsyncSession, digests: List[str]):
+    result = await db.execute(select(models.HistoryPayload).where(models.HistoryPayload.digest.in_(digests)))
+    return result.scalars().all()
+
+
+async def get_history_entries(db: AsyncSession, user_id: int, request_type: Optional[str] = None, skip: int = 0,
+                              limit: int = 20, before_id: Optional[int] = None, summary: bool = False):
+    """
+    Страница истории пользователя от новых записей к старым.
+    `before_id` — курсор keyset-пагинации: возвращаются записи с id меньше курсора,
+    поэтому стоимость страницы не растет с ее номером (в отличие от `skip`).
+    `summary=True` читает только служебные поля без `input_data`/`output_data`.
+    """
+    History = models.History
+    if summary:
+        query = select(History.id, History.request_type, History.created_at, History.user_id)
+    else:
+        query = select(History)
+    query = query.where(History.user_id == user_id)
 
     if request_type:
-        query = query.where(models.History.request_type == request_type)
+        query = query.where(History.request_type == request_type)
+    if before_id is not None:
+        query = query.where(History.id < before_id)
 
-    query = query.order_by(models.History.id.desc()).offset(skip).limit(limit)
+    query = query.order_by(History.id.desc()).offset(skip).limit(limit)
 
     result = await db.execute(query)
-    return result.scalars().all()
+    return result.mappings().all() if summary else result.scalars().all()
 
 
 async def get_user_by_email(db: AsyncSession, email: str):
@@ -56,3 +98,138 @@ async def update_user(db: AsyncSession, user: models.User, update_data: user_sch
     await db.commit()
     await db.refresh(user)
     return user
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def create_analytics_task(db: AsyncSession, task_id: str, user_id: int, file_path: str, filename: str,
+                                content_hash: Optional[str] = None):
+    db_task = models.AnalyticsTask(
+        id=task_id,
+        status="pending",
+        file_path=file_path,
+        filename=filename,
+        content_hash=content_hash,
+        user_id=user_id,
+        available_at=_utcnow(),
+    )
+    db.add(db_task)
+    await db.commit()
+    return db_task
+
+
+async def get_analytics_task(db: AsyncSession, task_id: str) -> Optional[models.AnalyticsTask]:
+    return await db.get(models.AnalyticsTask, task_id)
+
+
+def _leasable_task_clause(now: datetime, max_attempts: int):
+    task = models.AnalyticsTask
+    return and_(
+        task.attempts < max_attempts,
+        or_(
+            and_(task.status == "pending", task.available_at <= now),
+            and_(task.status == "processing", task.lease_expires_at < now),
+        ),
+    )
+
+
+async def lease_analytics_task(db: AsyncSession, worker_id: str, lease_seconds: int,
+                               max_attempts: int) -> Optional[models.AnalyticsTask]:
+    """
+    Захватывает следующую доступную задачу (новую или с истекшей арендой).
+    Захват — условный UPDATE по id, поэтому из нескольких воркеров задачу получит только один.
+    """
+    now = _utcnow()
+    candidates = await db.execute(
+        select(models.AnalyticsTask.id)
+        .where(_leasable_task_clause(now, max_attempts))
+        .order_by(models.AnalyticsTask.created_at)
+        .limit(5)
+    )
+    for task_id in candidates.scalars().all():
+        result = await db.execute(
+            update(models.AnalyticsTask)
+            .where(models.AnalyticsTask.id == task_id, _leasable_task_clause(now, max_attempts))
+            .values(
+                status="processing",
+                lease_owner=worker_id,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=models.AnalyticsTask.attempts + 1,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if result.rowcount == 1:
+            return await db.get(models.AnalyticsTask, task_id, populate_existing=True)
+    return None
+
+
+async def renew_analytics_task_lease(db: AsyncSession, task_id: str, worker_id: str, lease_seconds: int) -> bool:
+    result = await db.execute(
+        update(models.AnalyticsTask)
+        .where(models.AnalyticsTask.id == task_id, models.AnalyticsTask.lease_owner == worker_id,
+               models.AnalyticsTask.status == "processing")
+        .values(lease_expires_at=_utcnow() + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def finish_analytics_task(db: AsyncSession, task_id: str, worker_id: str, status: str,
+                                result: Dict[str, Any], ttl_hours: int) -> bool:
+    """Сохраняет результат, если аренда все еще у этого воркера; False — задачу уже забрал другой."""
+    updated = await db.execute(
+        update(models.AnalyticsTask)
+        .where(models.AnalyticsTask.id == task_id, models.AnalyticsTask.lease_owner == worker_id)
+        .values(status=status, result=result, lease_owner=None, lease_expires_at=None,
+                expires_at=_utcnow() + timedelta(hours=ttl_hours))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return updated.rowcount == 1
+
+
+async def retry_analytics_task(db: AsyncSession, task_id: str, worker_id: str, delay_seconds: int):
+    await db.execute(
+        update(models.AnalyticsTask)
+        .where(models.AnalyticsTask.id == task_id, models.AnalyticsTask.lease_owner == worker_id)
+        .values(status="pending", lease_owner=None, lease_expires_at=None,
+                available_at=_utcnow() + timedelta(seconds=delay_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def expire_analytics_tasks(db: AsyncSession, max_attempts: int, ttl_hours: int) -> List[str]:
+    """
+    Помечает ошибкой задачи, исчерпавшие попытки (например, после падения воркера),
+    и удаляет результаты с истекшим сроком хранения. Возвращает пути файлов удаленных задач.
+    """
+    now = _utcnow()
+    await db.execute(
+        update(models.AnalyticsTask)
+        .where(
+            models.AnalyticsTask.attempts >= max_attempts,
+            or_(
+                models.AnalyticsTask.status == "pending",
+                and_(models.AnalyticsTask.status == "processing", models.AnalyticsTask.lease_expires_at < now),
+            ),
+        )
+        .values(status="error", result={"error_message": "Превышено число попыток обработки файла."},
+                lease_owner=None, lease_expires_at=None, expires_at=now + timedelta(hours=ttl_hours))
+        .execution_options(synchronize_session=False)
+    )
+    expired = await db.execute(
+        select(models.AnalyticsTask.file_path).where(models.AnalyticsTask.expires_at < now)
+    )
+    file_paths = list(expired.scalars().all())
+    await db.execute(
+        delete(models.AnalyticsTask)
+        .where(models.AnalyticsTask.expires_at < now)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return file_paths
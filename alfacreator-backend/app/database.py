@@ -1,12 +1,69 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-DATABASE_URL = "sqlite+aiosqlite:///./history.db"
+from app.core.config import settings
+
+
+def _database_url(url: str) -> str:
+    """Приводит адрес PostgreSQL без указания драйвера к асинхронному драйверу asyncpg."""
+    for prefix in ("postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+def _engine_options(url) -> dict:
+    options = {"echo": settings.DB_ECHO}
+    if url.get_backend_name() == "sqlite":
+        # Ожидание блокировки вместо немедленной ошибки "database is locked".
+        options["connect_args"] = {"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+        if url.database in (None, "", ":memory:"):
+            return options
+    else:
+        options["pool_pre_ping"] = True
+    options.update(
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+    )
+    return options
+
+
+DATABASE_URL = _database_url(settings.DATABASE_URL)
+_url = make_url(DATABASE_URL)
+
+engine = create_async_engine(DATABASE_URL, **_engine_options(_url))
+
+if _url.get_backend_name() == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL: чтение не блокируется записью, а запись не ждет fsync на каждый коммит.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
 
-engine = create_async_engine(DATABASE_URL, echo=True)
 AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
 Base = declarative_base()
 
+
+def create_missing_indexes(connection):
+    """
+    `create_all` не добавляет индексы к уже существующим таблицам, поэтому
+    индексы, появившиеся в моделях позже, создаются отдельно (вызывать через `run_sync`).
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
 async def get_db():
+    """Единственная зависимость FastAPI для сессии БД; `app.core.dependencies` реэкспортирует ее."""
     async with AsyncSessionLocal() as session:
         yield session
@@ -0,0 +1,59 @@
+"""
+Общий процесс эмбеддингов для всех воркеров uvicorn.
+
+Запуск: `python -m app.embedding_server`. Модель загружается один раз, а воркеры
+API обращаются к ней по Unix-сокету EMBEDDING_SOCKET_PATH.
+"""
+import asyncio
+import json
+import os
+import sys
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.services.embedding_service import ERROR_MARKER, FRAME_HEADER, MATRIX_HEADER, KnowledgeBase
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, kb: KnowledgeBase):
+    try:
+        (size,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        texts = json.loads((await reader.readexactly(size)).decode("utf-8"))
+        try:
+            vectors = await asyncio.to_thread(kb.get_model().encode, texts)
+            matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+            writer.write(MATRIX_HEADER.pack(*matrix.shape) + matrix.tobytes())
+        except Exception as e:
+            message = str(e).encode("utf-8")
+            writer.write(MATRIX_HEADER.pack(ERROR_MARKER, len(message)) + message)
+        await writer.drain()
+    except asyncio.IncompleteReadError:
+        pass
+    finally:
+        writer.close()
+
+
+async def main():
+    socket_path = settings.EMBEDDING_SOCKET_PATH
+    if not socket_path:
+        raise SystemExit("Не задан EMBEDDING_SOCKET_PATH")
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    kb = KnowledgeBase(settings.EMBEDDING_MODEL_NAME, settings.CHROMA_DB_PATH, settings.KB_COLLECTION_NAME)
+    kb.get_model()
+
+    server = await asyncio.start_unix_server(lambda r, w: _handle(r, w, kb), path=socket_path)
+    logger.info(f"Сервер эмбеддингов слушает {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
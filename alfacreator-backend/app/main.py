@@ -2,8 +2,17 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 import sys
-from app.routers import promo, analytics, documents, smart_analytics, history, smm_bot_router, auth
-from app.database import engine, Base
+import asyncio
+from app.routers import promo, analytics, documents, smart_analytics, history, smm_bot_router, auth, health
+from app.database import engine, Base, create_missing_indexes
+from app.core.config import settings
+from app.core.llm_client import llm_client, ollama_pool
+from app.core.process_pool import shutdown_process_pool
+from app.core.uploads import UploadSizeLimitMiddleware
+from app.services.analytics_worker import AnalyticsWorkerPool
+from app.services.embedding_service import knowledge_base
+from app.services.history_writer import history_writer
+from app.services.rag_service import SYSTEM_PROMPT_WITH_TOOLS
 from app import models
 
 
@@ -13,17 +22,37 @@ app = FastAPI(
     version="1.0.0"
 )
 
+analytics_workers = AnalyticsWorkerPool(concurrency=settings.ANALYTICS_EMBEDDED_WORKERS)
+
 @app.on_event("startup")
 async def startup():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_missing_indexes)
+    await history_writer.start()
+    ollama_pool.start_health_checks()
+    analytics_workers.start()
+    if settings.RAG_WARMUP_ON_STARTUP:
+        asyncio.create_task(knowledge_base.warm_up())
+    if settings.LLM_PREFIX_WARMUP_ON_STARTUP:
+        asyncio.create_task(llm_client.warm_up_prefix(SYSTEM_PROMPT_WITH_TOOLS, use_case="tool_selection"))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await analytics_workers.stop()
+    await history_writer.stop()
+    await ollama_pool.stop_health_checks()
+    shutdown_process_pool()
 
+app.add_middleware(UploadSizeLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[history.NEXT_CURSOR_HEADER],
 )
 
 logger.remove()
@@ -41,3 +70,4 @@ app.include_router(smart_analytics.router, prefix="/api/v1/smart_analytics", tag
 app.include_router(history.router, prefix="/api/v1/history", tags=["История"])
 app.include_router(smm_bot_router.router, prefix="/api/v1/smm_bot", tags=["SMM Ассистент"])
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["Аутентификация"])
+app.include_router(health.router, prefix="/api/v1/health", tags=["Состояние сервиса"])
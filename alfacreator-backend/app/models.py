@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -14,6 +14,23 @@ class History(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="history_entries")
 
+    __table_args__ = (
+        # Keyset-пагинация истории: фильтр по пользователю (и типу) и обход по id в обратном порядке
+        # читаются прямо из индекса, без сортировки и пропуска строк.
+        Index("ix_history_user_type_id", "user_id", "request_type", "id"),
+        Index("ix_history_user_id_id", "user_id", "id"),
+    )
+
+class HistoryPayload(Base):
+    """Сжатое содержимое крупных полей истории; History хранит вместо него ссылку по хешу."""
+    __tablename__ = "history_payloads"
+
+    digest = Column(String, primary_key=True) # sha256 исходного JSON
+    codec = Column(String, nullable=False) # 'gzip'
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False) # размер исходного JSON в байтах
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class User(Base):
     __tablename__ = "users"
 
@@ -24,3 +41,21 @@ class User(Base):
     company_name = Column(String, nullable=True)
     job_title = Column(String, nullable=True)
     history_entries = relationship("History", back_populates="owner")
+
+
+class AnalyticsTask(Base):
+    __tablename__ = "analytics_tasks"
+
+    id = Column(String, primary_key=True)
+    status = Column(String, index=True, nullable=False, default="pending") # 'pending', 'processing', 'complete', 'error'
+    file_path = Column(String, nullable=False)
+    filename = Column(String, nullable=False)
+    content_hash = Column(String, nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    result = Column(JSON, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime(timezone=True), nullable=False)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,20 +1,35 @@
+"""
+Офлайн-индексация базы знаний: ChromaDB и лексический BM25-индекс рядом с ней.
+
+Запуск из каталога бэкенда: `python -m app.prepare_db` (`--full` — пересобрать с нуля).
+"""
+import argparse
+import hashlib
 import os
 import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from sentence_transformers import SentenceTransformer
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 import docx
 import pypdf
 import chromadb
 
+from app.services.lexical_index import LEXICAL_INDEX_FILE, build_lexical_index, save_lexical_index
+
+MANIFEST_FILE = "kb_manifest.json"
+# Меняется, когда формат чанков или их метаданных становится несовместим с уже проиндексированными.
+MANIFEST_VERSION = 2
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".json")
+
 
 def parse_pdf(file_path: str) -> str:
     """Извлекает текст из PDF файла."""
     try:
         reader = pypdf.PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        # Склеиваем страницы одним join: `+=` копирует накопленный текст на каждой странице.
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
     except Exception as e:
         print(f"Ошибка при чтении PDF {file_path}: {e}")
         return ""
@@ -40,7 +55,8 @@ def parse_json_smm(file_path: str) -> list:
             if "glossary" in data:
                 for term, definition in data["glossary"].items():
                     docs.append(
-                        {"text": f"Термин: {term}. Определение: {definition}", "source": os.path.basename(file_path)})
+                        {"text": f"Термин: {term}. Определение: {definition}", "source": os.path.basename(file_path),
+                         "term": term})
             if "modules" in data:
                 for module in data["modules"]:
                     for lesson in module["lessons"]:
@@ -50,85 +66,273 @@ def parse_json_smm(file_path: str) -> list:
     return docs
 
 
-def load_and_chunk_docs(folder_path: str) -> list:
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1000,
+    chunk_overlap=100,
+    length_function=len,
+)
+
+
+def iter_file_chunks(file_path: str) -> Iterator[dict]:
     """
-    Сканирует папку, парсит все файлы и разбивает текст на чанки.
+    Парсит один файл и по одному отдает его чанки.
+    Записи из JSON уже короткие и отдаются как есть.
     """
-    raw_docs = []
-    print(f"Сканирование папки '{folder_path}'...")
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        if not os.path.isfile(file_path):
-            continue
-
-        print(f"  - Обработка файла: {filename}")
-        if filename.endswith(".pdf"):
-            text = parse_pdf(file_path)
-            if text:
-                raw_docs.append({"text": text, "source": filename})
-        elif filename.endswith(".docx"):
-            text = parse_docx(file_path)
-            if text:
-                raw_docs.append({"text": text, "source": filename})
-        elif filename.endswith(".json"):
-            parsed_json_docs = parse_json_smm(file_path)
-            raw_docs.extend(parsed_json_docs)
-        else:
-            print(f"    - Пропущен неподдерживаемый формат: {filename}")
-
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=100, 
-        length_function=len,
-    )
+    filename = os.path.basename(file_path)
+    if filename.endswith(".json"):
+        yield from parse_json_smm(file_path)
+        return
 
-    final_docs = []
-    for doc in raw_docs:
-        if ".json" in doc["source"]:
-            final_docs.append(doc)
-        else:
-            chunks = text_splitter.split_text(doc["text"])
-            for chunk in chunks:
-                final_docs.append({"text": chunk, "source": doc["source"]})
+    if filename.endswith(".pdf"):
+        text = parse_pdf(file_path)
+    elif filename.endswith(".docx"):
+        text = parse_docx(file_path)
+    else:
+        return
+    if text:
+        for chunk in TEXT_SPLITTER.split_text(text):
+            yield {"text": chunk, "source": filename}
 
-    return final_docs
 
+def _chunk_metadata(doc: dict) -> dict:
+    metadata = {"source": doc["source"]}
+    if doc.get("term"):
+        metadata["term"] = doc["term"]
+    return metadata
 
-def main():
-    knowledge_base_path = "./knowledge_base"
 
-    print("Этап 1: Загрузка и обработка документов...")
-    documents = load_and_chunk_docs(knowledge_base_path)
-    if not documents:
-        print("Не найдено документов для обработки. Завершение.")
-        return
+def chunk_id(doc: dict) -> str:
+    """Идентификатор чанка по содержимому: неизмененные чанки сохраняют id при переиндексации."""
+    return hashlib.sha1(f"{doc['source']}\0{doc['text']}".encode("utf-8")).hexdigest()
 
-    print(f"\nЭтап 2: Загрузка embedding-модели (может занять время при первом запуске)...")
-    embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
 
-    print("\nЭтап 3: Создание векторов для чанков...")
-    embeddings = embedding_model.encode([doc["text"] for doc in documents], show_progress_bar=True)
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-    print("\nЭтап 4: Сохранение данных в ChromaDB...")
-    chroma_client = chromadb.PersistentClient(path="./chroma_db")
 
-    collection_name = "smm_assistant_kb"
-    if collection_name in [c.name for c in chroma_client.list_collections()]:
-        print(f"Удаление старой коллекции '{collection_name}'...")
-        chroma_client.delete_collection(name=collection_name)
+def load_manifest(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
 
-    print(f"Создание новой коллекции '{collection_name}'...")
-    collection = chroma_client.create_collection(name=collection_name)
 
-    collection.add(
-        embeddings=embeddings,
-        documents=[doc["text"] for doc in documents],
-        metadatas=[{"source": doc["source"]} for doc in documents],
-        ids=[str(i) for i in range(len(documents))]
-    )
+def save_manifest(path: str, manifest: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def parse_file(file_path: str, known_sha256: Optional[str]) -> Tuple[str, str, Optional[Dict[str, dict]]]:
+    """
+    Выполняется в процессе пула: хэширует файл и, если содержимое изменилось,
+    парсит его в словарь {id чанка: чанк}. Для неизмененного файла чанки не возвращаются.
+    """
+    sha256 = file_sha256(file_path)
+    if sha256 == known_sha256:
+        return file_path, sha256, None
+    docs = {}
+    for doc in iter_file_chunks(file_path):
+        docs.setdefault(chunk_id(doc), doc)
+    return file_path, sha256, docs
+
+
+def iter_parsed_files(file_jobs: Iterable[Tuple[str, Optional[str]]], workers: int) -> Iterator[tuple]:
+    """
+    Парсит файлы параллельно в пуле процессов. В работе одновременно не больше
+    `2 * workers` файлов, поэтому готовые результаты не копятся в памяти,
+    пока основной процесс занят эмбеддингом.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for file_path, known_sha256 in file_jobs:
+            pending.append(pool.submit(parse_file, file_path, known_sha256))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class KnowledgeBaseIndexer:
+    """
+    Инкрементально синхронизирует коллекцию ChromaDB с папкой документов.
+    Манифест хранит для каждого файла mtime, размер, sha256 и id его чанков:
+    неизмененные файлы пропускаются, у измененных эмбеддятся только новые чанки,
+    а чанки удаленных файлов и исчезнувшие фрагменты удаляются из коллекции.
 
-    print(f"\nГотово! Векторная база '{collection_name}' создана/обновлена.")
-    print(f"Всего обработано и добавлено чанков: {len(documents)}")
+    Конвейер потоковый: файлы парсятся в пуле процессов, новые чанки собираются
+    в батчи фиксированного размера, каждый батч эмбеддится и сразу пишется в коллекцию.
+    """
+    def __init__(self, knowledge_base_path: str, db_path: str, collection_name: str, model_name: str,
+                 workers: int, batch_size: int):
+        self.knowledge_base_path = knowledge_base_path
+        self.db_path = db_path
+        self.collection_name = collection_name
+        self.model_name = model_name
+        self.workers = workers
+        self.batch_size = batch_size
+        self.manifest_path = os.path.join(db_path, MANIFEST_FILE)
+
+        self.collection = None
+        self.embedding_model = None
+        self.known_files: Dict[str, dict] = {}
+        self.new_manifest_files: Dict[str, dict] = {}
+        self.added = 0
+        self.deleted = 0
+        self.unchanged = 0
+
+    def _open_collection(self, full_rebuild: bool):
+        os.makedirs(self.db_path, exist_ok=True)
+        manifest = load_manifest(self.manifest_path)
+
+        chroma_client = chromadb.PersistentClient(path=self.db_path)
+        collection_exists = self.collection_name in [c.name for c in chroma_client.list_collections()]
+
+        # Без манифеста или при смене модели старые векторы несовместимы — пересобираем с нуля.
+        if (full_rebuild or not collection_exists or manifest.get("model_name") != self.model_name
+                or manifest.get("version") != MANIFEST_VERSION):
+            if collection_exists:
+                print(f"Удаление старой коллекции '{self.collection_name}'...")
+                chroma_client.delete_collection(name=self.collection_name)
+            manifest = {}
+        self.collection = chroma_client.get_or_create_collection(name=self.collection_name)
+        self.known_files = manifest.get("files", {})
+
+    def _scan(self) -> Dict[str, str]:
+        print(f"Сканирование папки '{self.knowledge_base_path}'...")
+        files = {}
+        for filename in sorted(os.listdir(self.knowledge_base_path)):
+            file_path = os.path.join(self.knowledge_base_path, filename)
+            if not os.path.isfile(file_path):
+                continue
+            if not filename.endswith(SUPPORTED_EXTENSIONS):
+                print(f"    - Пропущен неподдерживаемый формат: {filename}")
+                continue
+            files[filename] = file_path
+        return files
+
+    def _file_jobs(self, files: Dict[str, str]) -> Iterator[Tuple[str, Optional[str]]]:
+        """Отдает файлы, которые нужно проверить по хэшу; совпавшие по mtime и размеру пропускаются сразу."""
+        for filename, file_path in files.items():
+            stat = os.stat(file_path)
+            entry = self.known_files.get(filename)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                self.new_manifest_files[filename] = entry
+                self.unchanged += 1
+                continue
+            yield file_path, entry["sha256"] if entry else None
+
+    def _new_chunks(self, parsed_files: Iterable[tuple]) -> Iterator[Tuple[str, dict]]:
+        """Сверяет чанки файла с манифестом: удаляет исчезнувшие и отдает только новые."""
+        for file_path, sha256, docs in parsed_files:
+            filename = os.path.basename(file_path)
+            stat = os.stat(file_path)
+            entry = self.known_files.get(filename)
+            if docs is None:
+                self.new_manifest_files[filename] = {**entry, "mtime": stat.st_mtime, "size": stat.st_size}
+                self.unchanged += 1
+                continue
+
+            print(f"  - Обработка файла: {filename}")
+            old_ids = set(entry["chunk_ids"]) if entry else set()
+            stale_ids = list(old_ids - docs.keys())
+            if stale_ids:
+                self.collection.delete(ids=stale_ids)
+                self.deleted += len(stale_ids)
+
+            self.new_manifest_files[filename] = {
+                "mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256, "chunk_ids": list(docs),
+            }
+            for doc_id, doc in docs.items():
+                if doc_id not in old_ids:
+                    yield doc_id, doc
+
+    def _store(self, batch: List[Tuple[str, dict]]):
+        if self.embedding_model is None:
+            print(f"Загрузка embedding-модели '{self.model_name}'...")
+            self.embedding_model = SentenceTransformer(self.model_name)
+        texts = [doc["text"] for _, doc in batch]
+        embeddings = self.embedding_model.encode(texts, batch_size=self.batch_size)
+        self.collection.upsert(
+            ids=[doc_id for doc_id, _ in batch],
+            embeddings=embeddings.tolist(),
+            documents=texts,
+            metadatas=[_chunk_metadata(doc) for _, doc in batch],
+        )
+        self.added += len(batch)
+
+    def _build_lexical_index(self, page_size: int = 1000):
+        """Перестраивает BM25-индекс и словарь терминов по всем чанкам коллекции, читая ее страницами."""
+        print("Построение лексического индекса...")
+
+        def documents():
+            offset = 0
+            while True:
+                page = self.collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+                if not page["ids"]:
+                    return
+                for doc_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                    yield doc_id, text, (metadata or {}).get("term")
+                offset += len(page["ids"])
+
+        save_lexical_index(os.path.join(self.db_path, LEXICAL_INDEX_FILE), build_lexical_index(documents()))
+
+    def run(self, full_rebuild: bool = False):
+        self._open_collection(full_rebuild)
+        files = self._scan()
+
+        parsed_files = iter_parsed_files(self._file_jobs(files), self.workers)
+        for batch in batched(self._new_chunks(parsed_files), self.batch_size):
+            self._store(batch)
+
+        for filename, entry in self.known_files.items():
+            if filename not in files and entry["chunk_ids"]:
+                print(f"  - Файл удален: {filename}")
+                self.collection.delete(ids=entry["chunk_ids"])
+                self.deleted += len(entry["chunk_ids"])
+
+        if self.added or self.deleted or not os.path.exists(os.path.join(self.db_path, LEXICAL_INDEX_FILE)):
+            self._build_lexical_index()
+
+        save_manifest(self.manifest_path, {
+            "version": MANIFEST_VERSION, "model_name": self.model_name, "files": self.new_manifest_files,
+        })
+        print(f"\nГотово! Коллекция '{self.collection_name}': добавлено {self.added}, удалено {self.deleted} чанков, "
+              f"без изменений файлов: {self.unchanged}. Всего чанков: {self.collection.count()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индексация базы знаний в ChromaDB")
+    parser.add_argument("--full", action="store_true", help="пересобрать коллекцию с нуля")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число процессов для парсинга")
+    parser.add_argument("--batch-size", type=int, default=64, help="размер батча эмбеддинга и записи в ChromaDB")
+    args = parser.parse_args()
+
+    indexer = KnowledgeBaseIndexer(
+        knowledge_base_path="./knowledge_base",
+        db_path="./chroma_db",
+        collection_name="smm_assistant_kb",
+        model_name="paraphrase-multilingual-MiniLM-L12-v2",
+        workers=args.workers,
+        batch_size=args.batch_size,
+    )
+    indexer.run(full_rebuild=args.full)
 
 
 if __name__ == "__main__":
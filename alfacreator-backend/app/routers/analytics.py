@@ -1,14 +1,16 @@
 import uuid
 import os
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import crud
 from app.schemas.analytics import TaskResponse, TaskStatusResponse
-from app.services.analytics_processor import process_sales_file, TASK_STORAGE
-from app.core.dependencies import get_current_user
+from app.core.dependencies import get_db, get_current_user
+from app.core.uploads import UPLOAD_DIR, save_upload
+from app.services.dataframe_jobs import ARROW_EXTENSIONS, PARQUET_EXTENSIONS
 from app.schemas.user import User as UserSchema
-import aiofiles
 
 router = APIRouter()
-UPLOAD_DIR = "temp_uploads"
+ANALYTICS_EXTENSIONS = (".csv",) + PARQUET_EXTENSIONS + ARROW_EXTENSIONS
 
 
 @router.on_event("startup")
@@ -18,36 +20,36 @@ async def startup_event():
 
 @router.post("/upload", response_model=TaskResponse, status_code=202)
 async def upload_file_for_analysis(
-        background_tasks: BackgroundTasks,
         file: UploadFile = File(...),
+        db: AsyncSession = Depends(get_db),
         current_user: UserSchema = Depends(get_current_user)
 
 ):
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Поддерживаются только CSV файлы")
+    if not file.filename.endswith(ANALYTICS_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Поддерживаются только файлы CSV, Parquet и Arrow IPC")
 
     task_id = str(uuid.uuid4())
     file_path = os.path.join(UPLOAD_DIR, f"{task_id}_{file.filename}")
 
-    async with aiofiles.open(file_path, 'wb') as out_file:
-        content = await file.read()
-        await out_file.write(content)
+    stored = await save_upload(file, file_path)
 
-    TASK_STORAGE[task_id] = {"status": "processing", "result": None}
-
-    background_tasks.add_task(
-        process_sales_file, 
-        task_id=task_id, 
-        file_path=file_path, 
-        user_id=current_user.id
+    await crud.create_analytics_task(
+        db,
+        task_id=task_id,
+        user_id=current_user.id,
+        file_path=file_path,
+        filename=file.filename,
+        content_hash=stored.sha256
     )
 
     return TaskResponse(task_id=task_id, status="processing")
 
 
 @router.get("/results/{task_id}", response_model=TaskStatusResponse)
-async def get_analysis_results(task_id: str):
-    task = TASK_STORAGE.get(task_id)
+async def get_analysis_results(task_id: str, db: AsyncSession = Depends(get_db)):
+    task = await crud.get_analytics_task(db, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Задача с таким ID не найдена")
-    return TaskStatusResponse(status=task.get("status"), result=task.get("result"))
\ No newline at end of file
+    # Для клиента задача в очереди и задача в работе неразличимы.
+    status = "processing" if task.status == "pending" else task.status
+    return TaskStatusResponse(status=status, result=task.result)
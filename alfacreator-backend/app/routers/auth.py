@@ -4,10 +4,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from fastapi.concurrency import run_in_threadpool
 
-from app import crud
+from app import crud, models
 from app.schemas import user as user_schema, token as token_schema
 from app.core import security
-from app.core.dependencies import get_db, get_current_user
+from app.core.dependencies import get_db, get_current_user, get_current_db_user
+from app.core.user_cache import user_cache
 from app.core.config import settings
 
 router = APIRouter()
@@ -36,7 +37,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = security.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -51,21 +52,24 @@ async def read_users_me(current_user: user_schema.User = Depends(get_current_use
 async def update_current_user(
     update_data: user_schema.UserUpdate,
     db: AsyncSession = Depends(get_db),
-    current_user: user_schema.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_db_user)
 ):
 
     if update_data.email and update_data.email != current_user.email:
         existing_user = await crud.get_user_by_email(db, email=update_data.email)
         if existing_user:
             raise HTTPException(status_code=400, detail="Этот email уже используется другим пользователем.")
-    return await crud.update_user(db=db, user=current_user, update_data=update_data)
+    old_email = current_user.email
+    updated_user = await crud.update_user(db=db, user=current_user, update_data=update_data)
+    user_cache.invalidate(old_email, updated_user.email)
+    return updated_user
 
 
 @router.post("/users/me/change-password")
 async def change_current_user_password(
     password_data: user_schema.PasswordUpdate,
     db: AsyncSession = Depends(get_db),
-    current_user: user_schema.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_db_user)
 ):
     is_correct_password = await run_in_threadpool(
         security.verify_password, password_data.current_password, current_user.hashed_password
@@ -73,8 +77,11 @@ async def change_current_user_password(
     if not is_correct_password:
         raise HTTPException(status_code=400, detail="Неверный текущий пароль")
         
+    # После commit ORM-объект просрочен, и чтение атрибута потребовало бы ленивой загрузки.
+    email = current_user.email
     current_user.hashed_password = security.get_password_hash(password_data.new_password)
     db.add(current_user)
     await db.commit()
-    
+    user_cache.invalidate(email)
+
     return {"message": "Пароль успешно изменен"}
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.schemas.documents import DocumentRequest, DocumentResponse
-from app.core.dependencies import get_db, get_current_user
+from app.core.dependencies import get_current_user
+from app.core.streaming import sse_response
 from app.schemas import user as user_schema
 from app.services import document_service
 
@@ -11,15 +11,24 @@ router = APIRouter()
 @router.post("/generate", response_model=DocumentResponse)
 async def generate_document(
     request: DocumentRequest, 
-    db: AsyncSession = Depends(get_db), 
     current_user: user_schema.User = Depends(get_current_user)
 ):
     try:
         generated_text = await document_service.generate_document_logic(
             request=request, 
-            db=db, 
             user_id=current_user.id
         )
         return DocumentResponse(generated_text=generated_text)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при генерации документа: {str(e)}")
+
+
+@router.post("/generate/stream", summary="Потоковая генерация документа (SSE)")
+async def generate_document_stream(
+    request: DocumentRequest,
+    current_user: user_schema.User = Depends(get_current_user)
+):
+    events = document_service.stream_document_logic(request=request, user_id=current_user.id)
+    return sse_response(events)
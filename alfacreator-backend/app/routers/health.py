@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.core.llm_client import llm_cache, llm_client, ollama_pool
+from app.core.llm_scheduler import llm_scheduler
+from app.services.embedding_service import knowledge_base
+from app.services.history_writer import history_writer
+from app.services.intent_router import intent_router
+
+router = APIRouter()
+
+
+@router.get("/llm", summary="Состояние LLM-клиента", description="Состояние узлов Ollama, кэша ответов LLM, объединения запросов, очереди генераций и локального выбора инструментов.")
+async def llm_health():
+    return {
+        "nodes": ollama_pool.stats(),
+        "cache": llm_cache.stats() if llm_cache else {"enabled": False},
+        "single_flight": llm_client.inflight.stats(),
+        "scheduler": llm_scheduler.stats(),
+        "intent_router": intent_router.stats(),
+    }
+
+
+@router.get("/history", summary="Отложенная запись истории", description="Размер очереди записи истории, число записанных пачек и записей, сохраненных в резервный журнал.")
+async def history_health():
+    return history_writer.stats()
+
+
+@router.get("/rag", summary="Готовность базы знаний", description="Загружены ли embedding-модель и коллекция ChromaDB. Пока ресурсы не загружены, возвращает 503.")
+async def rag_health():
+    status = knowledge_base.status()
+    return JSONResponse(content=status, status_code=200 if status["ready"] else 503)
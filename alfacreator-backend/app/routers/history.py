@@ -1,29 +1,53 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Optional
+from typing import List, Optional, Union
 
 from app import crud
 from app.schemas import history as history_schema
 from app.schemas import user as user_schema
-from app.core.dependencies import get_db, get_current_user
+from app.core.dependencies import get_db, get_current_user_from_claims
+from app.services.history_payloads import inflate_entries
 
 router = APIRouter()
 
-@router.get("/", response_model=List[history_schema.History])
-async def read_history_for_current_user(
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 
+@router.get("/", response_model=List[Union[history_schema.History, history_schema.HistorySummary]])
+async def read_history_for_current_user(
+    response: Response,
     request_type: Optional[str] = Query(None, description="Тип запроса для фильтрации (например, 'promo')"),
-    skip: int = 0,
-    limit: int = 100,
+    cursor: Optional[int] = Query(None, description="Значение заголовка X-Next-Cursor из предыдущей страницы"),
+    summary: bool = Query(False, description="Только id, тип и дата, без входных и выходных данных"),
+    skip: int = Query(0, ge=0, description="Устаревшая offset-пагинация; для глубоких страниц используйте cursor"),
+    limit: int = Query(100, ge=1, le=200),
     db: AsyncSession = Depends(get_db),
-    current_user: user_schema.User = Depends(get_current_user),
+    current_user: user_schema.User = Depends(get_current_user_from_claims),
 ):
-
     history_entries = await crud.get_history_entries(
-        db=db, 
-        user_id=current_user.id, 
-        request_type=request_type, 
-        skip=skip, 
-        limit=limit
+        db=db,
+        user_id=current_user.id,
+        request_type=request_type,
+        skip=skip,
+        limit=limit,
+        before_id=cursor,
+        summary=summary,
     )
+    # Полная страница — возможно, есть следующая; курсор указывает на последнюю отданную запись.
+    if len(history_entries) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(history_entries[-1]["id"] if summary else history_entries[-1].id)
+    # Список не распаковывает вынесенное содержимое: крупные поля приходят заглушкой
+    # {"$payload": ..., "size": ...}, целиком запись отдает GET /{entry_id}.
     return history_entries
+
+
+@router.get("/{entry_id}", response_model=history_schema.History)
+async def read_history_entry(
+    entry_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: user_schema.User = Depends(get_current_user_from_claims),
+):
+    entry = await crud.get_history_entry(db, user_id=current_user.id, entry_id=entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Запись истории не найдена")
+    return (await inflate_entries(db, [entry]))[0]
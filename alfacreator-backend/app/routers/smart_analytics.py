@@ -1,23 +1,24 @@
-import io
 import json
-import pandas as pd
+import os
+import uuid
 import httpx
 from fastapi import (
     APIRouter, UploadFile, Form, HTTPException, Query, File, Depends
 )
 from fastapi.responses import JSONResponse
 from fastapi import Depends
-from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 
 from app.services import social_parser
 from app.schemas.socialmedia import SocialMediaInfo
 from app.core.llm_client import llm_client
-from app.database import get_db
-from app import crud
-from app.core.dependencies import get_db, get_current_user
+from app.core.process_pool import JobLimitExceeded, run_in_process
+from app.core.uploads import UPLOAD_DIR, save_upload
+from app.services.dataframe_jobs import summarize_client_file
+from app.core.dependencies import get_current_user
 from app.schemas.user import User as UserSchema
 from app.schemas import history as history_schema
+from app.services.history_writer import history_writer
 
 
 router = APIRouter()
@@ -36,7 +37,6 @@ async def get_social_analysis(link: str = Query(..., description="Ссылка 
 
 @router.post("/smart")
 async def analyze_business(
-        db: AsyncSession = Depends(get_db),
         file: Optional[UploadFile] = File(None),
         link: Optional[str] = Form(None),
         current_user: UserSchema = Depends(get_current_user)
@@ -47,13 +47,15 @@ async def analyze_business(
 
     user_data_summary = None
     if file:
-        contents = await file.read()
+        stored = await save_upload(file, os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}_{file.filename}"))
         try:
-            df = pd.read_csv(io.BytesIO(contents)) if file.filename.endswith(".csv") else pd.read_excel(
-                io.BytesIO(contents))
-            user_data_summary = summarize_client_data(df)
+            user_data_summary = await run_in_process(summarize_client_file, stored.path, file.filename)
+        except JobLimitExceeded as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Ошибка чтения файла: {e}")
+        finally:
+            os.remove(stored.path)
 
     social_data_summary = None
     if link:
@@ -109,7 +111,8 @@ async def analyze_business(
         }}
         """
 
-        result_str = await llm_client.generate_json_response(prompt)
+        result_str = await llm_client.generate_json_response(prompt, use_case="smart_plan",
+                                                            user_id=current_user.id)
         result_data = json.loads(result_str)
 
         input_data_for_history = {"link": link, "filename": file.filename if file else None}
@@ -119,29 +122,16 @@ async def analyze_business(
             output_data=result_data
         )
 
-        await crud.create_history_entry(
-            db=db,
-            user_id=current_user.id,
-            entry=history_entry_data
-        )
+        history_writer.submit(current_user.id, history_entry_data)
 
         return JSONResponse(content=result_data)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def summarize_client_data(df: pd.DataFrame) -> str:
-    try:
-        info = f"Найдено {len(df)} строк. Колонки: {', '.join(df.columns)}."
-        if "amount" in df.columns and pd.api.types.is_numeric_dtype(df["amount"]):
-            avg_amount = df["amount"].mean()
-            info += f" Средний чек: {avg_amount:.2f}."
-        return info
-    except Exception:
-        return "Не удалось проанализировать структуру файла."
-
-
 async def get_latest_trends() -> str:
     try:
         async with httpx.AsyncClient() as client:
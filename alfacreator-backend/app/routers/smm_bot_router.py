@@ -1,13 +1,14 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
 from pydantic import BaseModel
-from typing import Optional
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.core.dependencies import get_db, get_current_user
+from typing import AsyncIterator, Optional, Tuple
+from app.core.dependencies import get_current_user
+from app.core.streaming import StreamEvent, sse_response
+from app.core.uploads import hash_upload
 from app.schemas import user as user_schema
 from app.schemas import history as history_schema
-from app import crud
+from app.services.history_writer import history_writer
 
-from app.services.rag_service import get_bot_response
+from app.services.rag_service import get_bot_response, stream_bot_response
 from app.core.llm_client import llm_client
 
 
@@ -18,15 +19,7 @@ class ChatResponse(BaseModel):
     reply: str
 
 
-@router.post("/chat", response_model=ChatResponse)
-async def handle_chat_message(
-
-        db: AsyncSession = Depends(get_db),
-        current_user: user_schema.User = Depends(get_current_user),
-
-        message: str = Form(""),
-        file: Optional[UploadFile] = File(None)
-):
+async def _prepare_chat_query(message: str, file: Optional[UploadFile]) -> Tuple[str, dict]:
     if not message and not file:
         raise HTTPException(status_code=400, detail="Сообщение или файл должны быть предоставлены.")
 
@@ -35,26 +28,61 @@ async def handle_chat_message(
 
     if file:
 
-        contents = await file.read()
+        # Содержимое файла в запрос не передается: только проверяем размер и считаем хэш.
+        stored = await hash_upload(file)
         file_text = f"\n\n--- Приложен файл: {file.filename} ---"
         query += file_text
         input_data_for_history["filename"] = file.filename
+        input_data_for_history["sha256"] = stored.sha256
 
-    bot_reply = await get_bot_response(
-        query=query, 
-        llm_client=llm_client,
-        user_id=current_user.id
-    )
+    return query, input_data_for_history
 
+
+def _save_chat_history(user_id: int, input_data: dict, bot_reply: str):
     history_entry_data = history_schema.HistoryCreate(
         request_type="smm_bot",
-        input_data=input_data_for_history,
+        input_data=input_data,
         output_data={"reply": bot_reply}
     )
-    await crud.create_history_entry(
-        db=db,
-        user_id=current_user.id,
-        entry=history_entry_data
+    history_writer.submit(user_id, history_entry_data)
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def handle_chat_message(
+
+        current_user: user_schema.User = Depends(get_current_user),
+
+        message: str = Form(""),
+        file: Optional[UploadFile] = File(None)
+):
+    query, input_data_for_history = await _prepare_chat_query(message, file)
+
+    bot_reply = await get_bot_response(
+        query=query, 
+        llm_client=llm_client,
+        user_id=current_user.id
     )
 
+    _save_chat_history(current_user.id, input_data_for_history, bot_reply)
+
     return ChatResponse(reply=bot_reply)
+
+
+@router.post("/chat/stream", summary="Потоковый ответ ассистента (SSE)")
+async def handle_chat_message_stream(
+        current_user: user_schema.User = Depends(get_current_user),
+        message: str = Form(""),
+        file: Optional[UploadFile] = File(None)
+):
+    query, input_data_for_history = await _prepare_chat_query(message, file)
+    user_id = current_user.id
+    # До отправки заголовков: при перегрузке клиент получит 429/503 с Retry-After.
+    llm_client.scheduler.check_admission("tool_selection", user_id)
+
+    async def events() -> AsyncIterator[StreamEvent]:
+        async for event, data in stream_bot_response(query=query, llm_client=llm_client, user_id=user_id):
+            if event == "done":
+                _save_chat_history(user_id, input_data_for_history, data["reply"])
+            yield event, data
+
+    return sse_response(events())
@@ -20,3 +20,13 @@ class History(HistoryBase):
 
     class Config:
         from_attributes = True
+
+
+class HistorySummary(BaseModel):
+    id: int
+    user_id: int
+    request_type: str
+    created_at: datetime.datetime
+
+    class Config:
+        from_attributes = True
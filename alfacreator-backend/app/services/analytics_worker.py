@@ -0,0 +1,134 @@
+import asyncio
+import os
+import socket
+from typing import List, Optional
+
+from loguru import logger
+
+from app import crud
+from app.core.config import settings
+from app.core.process_pool import JobLimitExceeded
+from app.database import AsyncSessionLocal
+from app.services.analytics_processor import process_sales_file
+
+
+class AnalyticsWorkerPool:
+    """
+    Пул воркеров, разбирающих очередь задач аналитики из БД.
+    Задача берется в аренду (lease) и периодически продлевается; если воркер
+    упал, аренда истекает и задачу подхватывает другой процесс.
+    """
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._tasks: List[asyncio.Task] = []
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def _heartbeat(self, task_id: str, worker_id: str):
+        """Продлевает аренду задачи; завершается, только если аренда потеряна."""
+        interval = max(1, settings.ANALYTICS_TASK_LEASE_SECONDS // 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with AsyncSessionLocal() as db:
+                    renewed = await crud.renew_analytics_task_lease(
+                        db, task_id, worker_id, settings.ANALYTICS_TASK_LEASE_SECONDS
+                    )
+            except Exception as e:
+                logger.warning(f"[{task_id}] Не удалось продлить аренду задачи, повтор через {interval} с: {e}")
+                continue
+            if not renewed:
+                return
+
+    async def _run_task(self, task, worker_id: str):
+        job = asyncio.create_task(process_sales_file(
+            task_id=task.id, file_path=task.file_path, filename=task.filename, user_id=task.user_id,
+            content_hash=task.content_hash
+        ))
+        heartbeat = asyncio.create_task(self._heartbeat(task.id, worker_id))
+        try:
+            await asyncio.wait({job, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            heartbeat.cancel()
+            if not job.done():
+                job.cancel()
+        if not job.done() or job.cancelled():
+            # Аренда истекла и задача отдана другому воркеру: ни результат, ни файл больше не наши.
+            logger.warning(f"[{task.id}] Аренда задачи потеряна воркером {worker_id}, обработка прервана.")
+            return
+
+        try:
+            result = job.result()
+            status = "complete"
+        except Exception as e:
+            logger.error(f"[{task.id}] Ошибка при обработке файла (попытка {task.attempts}): {e}", exc_info=True)
+            # Превышение лимитов детерминировано, повтор ничего не даст.
+            retryable = not isinstance(e, JobLimitExceeded)
+            if retryable and task.attempts < settings.ANALYTICS_TASK_MAX_ATTEMPTS:
+                async with AsyncSessionLocal() as db:
+                    await crud.retry_analytics_task(
+                        db, task.id, worker_id, settings.ANALYTICS_TASK_RETRY_DELAY_SECONDS * task.attempts
+                    )
+                return
+            result, status = {"error_message": str(e)}, "error"
+
+        async with AsyncSessionLocal() as db:
+            owned = await crud.finish_analytics_task(
+                db, task.id, worker_id, status, result, settings.ANALYTICS_RESULT_TTL_HOURS
+            )
+        if owned:
+            _remove_file(task.file_path)
+        else:
+            logger.warning(f"[{task.id}] Задачу уже обрабатывает другой воркер, результат и файл оставлены ему.")
+
+    async def _expire(self):
+        async with AsyncSessionLocal() as db:
+            file_paths = await crud.expire_analytics_tasks(
+                db, settings.ANALYTICS_TASK_MAX_ATTEMPTS, settings.ANALYTICS_RESULT_TTL_HOURS
+            )
+        for file_path in file_paths:
+            _remove_file(file_path)
+
+    async def _worker(self, number: int):
+        worker_id = f"{self._worker_prefix}:{number}"
+        logger.info(f"Воркер аналитики {worker_id} запущен.")
+        idle_polls = 0
+        while True:
+            try:
+                # Обслуживание очереди выполняет только первый воркер, примерно раз в минуту простоя.
+                if number == 0 and idle_polls % 60 == 0:
+                    await self._expire()
+
+                async with AsyncSessionLocal() as db:
+                    task = await crud.lease_analytics_task(
+                        db, worker_id, settings.ANALYTICS_TASK_LEASE_SECONDS, settings.ANALYTICS_TASK_MAX_ATTEMPTS
+                    )
+                if task is None:
+                    idle_polls += 1
+                    await asyncio.sleep(settings.ANALYTICS_POLL_INTERVAL_SECONDS)
+                    continue
+
+                idle_polls = 0
+                await self._run_task(task, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Сбой воркера аналитики {worker_id}: {e}", exc_info=True)
+                await asyncio.sleep(settings.ANALYTICS_POLL_INTERVAL_SECONDS)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def _remove_file(file_path: Optional[str]):
+    if file_path and os.path.exists(file_path):
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            logger.warning(f"Не удалось удалить файл {file_path}: {e}")
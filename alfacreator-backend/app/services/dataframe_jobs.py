@@ -0,0 +1,147 @@
+"""
+Функции разбора и агрегации DataFrame, выполняемые в пуле процессов
+(`app.core.process_pool.run_in_process`). Модуль намеренно не импортирует
+ничего из веб-приложения, чтобы процессы-воркеры стартовали быстро.
+"""
+import os
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+SALES_COLUMNS = ["price", "product", "day_of_week"]
+PARQUET_EXTENSIONS = (".parquet",)
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+
+
+class SalesAggregate:
+    """
+    Инкрементальные агрегаты по продажам. Каждый фрагмент файла обрабатывается
+    отдельно, а частичные результаты складываются, поэтому память не зависит
+    от размера файла.
+    """
+    def __init__(self):
+        self.transactions = 0
+        self.total_revenue = 0.0
+        self.product_counts: Counter = Counter()
+        self.sales_by_day: Dict[Any, Any] = {}
+
+    def update(self, chunk: pd.DataFrame):
+        self.transactions += int(chunk['price'].count())
+        self.total_revenue += float(chunk['price'].sum())
+        self.product_counts.update(chunk['product'].value_counts().to_dict())
+        for day, value in chunk.groupby('day_of_week')['price'].sum().to_dict().items():
+            self.sales_by_day[day] = self.sales_by_day.get(day, 0) + value
+
+    def result(self) -> Dict[str, Any]:
+        if not self.product_counts:
+            raise ValueError("В файле нет данных о продажах.")
+        # Как и Series.mode(): при равенстве частот берется наименьшее значение.
+        top_count = max(self.product_counts.values())
+        top_product = sorted(p for p, count in self.product_counts.items() if count == top_count)[0]
+        return {
+            "transactions": self.transactions,
+            "total_revenue": self.total_revenue,
+            "average_check": self.total_revenue / self.transactions if self.transactions else 0.0,
+            "top_product": top_product,
+            "sales_by_day": dict(sorted(self.sales_by_day.items())),
+        }
+
+
+def aggregate_sales(chunks: Iterable[pd.DataFrame]) -> Dict[str, Any]:
+    aggregate = SalesAggregate()
+    for chunk in chunks:
+        aggregate.update(chunk)
+    return aggregate.result()
+
+
+def _open_arrow_table(file_path: str) -> pa.Table:
+    # memory_map: данные не копируются в память процесса, а читаются со страниц файла.
+    source = pa.memory_map(file_path, "r")
+    try:
+        return pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        source.seek(0)
+        return pa.ipc.open_stream(source).read_all()
+
+
+def iter_sales_chunks(file_path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Читает только нужные для аналитики колонки фрагментами по `chunk_rows` строк."""
+    if file_path.endswith(PARQUET_EXTENSIONS):
+        parquet_file = pq.ParquetFile(file_path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=SALES_COLUMNS):
+            yield batch.to_pandas()
+    elif file_path.endswith(ARROW_EXTENSIONS):
+        table = _open_arrow_table(file_path).select(SALES_COLUMNS)
+        for batch in table.to_batches(max_chunksize=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(file_path, usecols=SALES_COLUMNS, chunksize=chunk_rows)
+
+
+def convert_csv_to_parquet(csv_path: str, parquet_path: str):
+    """
+    Потоково конвертирует CSV в Parquet (только колонки аналитики).
+    Файл пишется во временный путь и переименовывается атомарно.
+    """
+    tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+    reader = pa_csv.open_csv(csv_path, convert_options=pa_csv.ConvertOptions(include_columns=SALES_COLUMNS))
+    try:
+        with pq.ParquetWriter(tmp_path, reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+        os.replace(tmp_path, parquet_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def summarize_sales_file(file_path: str, chunk_rows: int, parquet_cache_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Считает агрегаты по файлу продаж. Если передан `parquet_cache_path`, CSV
+    один раз конвертируется в Parquet, и повторный анализ того же содержимого
+    читает уже готовый колоночный файл.
+    """
+    if parquet_cache_path:
+        if not os.path.exists(parquet_cache_path):
+            try:
+                convert_csv_to_parquet(file_path, parquet_cache_path)
+            except (pa.ArrowInvalid, pa.ArrowKeyError):
+                # pyarrow строже pandas к типам колонок; такой файл разбираем как обычный CSV.
+                return aggregate_sales(iter_sales_chunks(file_path, chunk_rows))
+        file_path = parquet_cache_path
+    return aggregate_sales(iter_sales_chunks(file_path, chunk_rows))
+
+
+def _describe_client_data(num_rows: int, columns: List[str], amount: Optional[pd.Series]) -> str:
+    try:
+        info = f"Найдено {num_rows} строк. Колонки: {', '.join(columns)}."
+        if amount is not None and pd.api.types.is_numeric_dtype(amount):
+            avg_amount = amount.mean()
+            info += f" Средний чек: {avg_amount:.2f}."
+        return info
+    except Exception:
+        return "Не удалось проанализировать структуру файла."
+
+
+def summarize_client_data(df: pd.DataFrame) -> str:
+    return _describe_client_data(len(df), list(df.columns), df["amount"] if "amount" in df.columns else None)
+
+
+def summarize_client_file(file_path: str, filename: str) -> str:
+    if filename.endswith(PARQUET_EXTENSIONS):
+        # Число строк и схема берутся из метаданных, с диска читается только колонка `amount`.
+        parquet_file = pq.ParquetFile(file_path, memory_map=True)
+        columns = parquet_file.schema_arrow.names
+        amount = parquet_file.read(columns=["amount"]).column("amount").to_pandas() if "amount" in columns else None
+        return _describe_client_data(parquet_file.metadata.num_rows, columns, amount)
+    if filename.endswith(ARROW_EXTENSIONS):
+        table = _open_arrow_table(file_path)
+        amount = table.column("amount").to_pandas() if "amount" in table.column_names else None
+        return _describe_client_data(table.num_rows, table.column_names, amount)
+
+    df = pd.read_csv(file_path) if filename.endswith(".csv") else pd.read_excel(file_path)
+    return summarize_client_data(df)
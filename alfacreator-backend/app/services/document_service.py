@@ -1,23 +1,21 @@
-from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
+from typing import AsyncIterator
 
 from app.schemas.documents import DocumentRequest
 from app.services.template_store import TEMPLATES
 from app.core.llm_client import llm_client
+from app.core.streaming import StreamEvent
 from app.schemas import history as history_schema
-from app import crud
+from app.services.history_writer import history_writer
 
-async def generate_document_logic(
-    request: DocumentRequest,
-    db: AsyncSession,
-    user_id: int
-) -> str:
+
+def _build_document_prompt(request: DocumentRequest) -> str:
     template = TEMPLATES.get(request.template_name)
     if not template:
         raise HTTPException(status_code=404, detail="Шаблон не найден")
 
     details_str = "\n".join([f"- {key}: {value}" for key, value in request.details.items()])
-    prompt = (
+    return (
         "Ты — юридический ассистент. Твоя задача — аккуратно заполнить шаблон документа на основе предоставленных данных. "
         "Замени все значения в [квадратных скобках] на соответствующие данные от пользователя. "
         "Если каких-то данных нет, оставь placeholder [ДАННЫЕ НЕ УКАЗАНЫ]. "
@@ -31,21 +29,46 @@ async def generate_document_logic(
         "Отвечай СТРОГО на русском языке. Верни только готовый текст документа без каких-либо комментариев."
     )
 
-    try:
-        response = await llm_client.client.generate(
-            model=llm_client.model, prompt=prompt, stream=False
-        )
-        generated_text = response['response'].strip()
-
-        history_entry_data = history_schema.HistoryCreate(
-            request_type="document",
-            input_data=request.model_dump(),
-            output_data={"generated_text": generated_text}
-        )
-        await crud.create_history_entry(
-            db=db, user_id=user_id, entry=history_entry_data
-        )
-        
-        return generated_text
-    except Exception as e:
-        raise e
+
+def _save_document_history(user_id: int, request: DocumentRequest, generated_text: str):
+    history_entry_data = history_schema.HistoryCreate(
+        request_type="document",
+        input_data=request.model_dump(),
+        output_data={"generated_text": generated_text}
+    )
+    history_writer.submit(user_id, history_entry_data)
+
+
+async def generate_document_logic(
+    request: DocumentRequest,
+    user_id: int
+) -> str:
+    prompt = _build_document_prompt(request)
+
+    generated_text = await llm_client.generate_text(prompt, use_case="document", user_id=user_id)
+    _save_document_history(user_id, request, generated_text)
+
+    return generated_text
+
+
+def stream_document_logic(request: DocumentRequest, user_id: int) -> AsyncIterator[StreamEvent]:
+    """
+    Потоковый вариант `generate_document_logic`. Шаблон и загрузка очереди к LLM
+    проверяются сразу, до начала ответа, чтобы ошибки 404 и 429/503 вернулись
+    обычным HTTP-статусом.
+    """
+    prompt = _build_document_prompt(request)
+    llm_client.scheduler.check_admission("document", user_id)
+    return _stream_document(prompt, request, user_id)
+
+
+async def _stream_document(prompt: str, request: DocumentRequest, user_id: int) -> AsyncIterator[StreamEvent]:
+    parts = []
+    async for chunk in llm_client.stream_response(prompt, use_case="document", user_id=user_id):
+        parts.append(chunk)
+        yield "token", {"text": chunk}
+
+    generated_text = "".join(parts).strip()
+    _save_document_history(user_id, request, generated_text)
+
+    yield "done", {"generated_text": generated_text}
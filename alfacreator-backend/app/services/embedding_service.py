@@ -0,0 +1,452 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.services.lexical_index import LEXICAL_INDEX_FILE, LexicalIndex
+
+FRAME_HEADER = struct.Struct("!I")
+MATRIX_HEADER = struct.Struct("!II")
+ERROR_MARKER = 0xFFFFFFFF
+
+
+def _recv_exact(conn: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Сервер эмбеддингов закрыл соединение")
+        data.extend(chunk)
+    return bytes(data)
+
+
+class RemoteEmbeddingClient:
+    """
+    Клиент общего процесса эмбеддингов (`app.embedding_server`), доступного по Unix-сокету.
+    Запрос: длина + JSON-список текстов; ответ: (n, dim) + матрица float32.
+    """
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        payload = json.dumps(texts, ensure_ascii=False).encode("utf-8")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(self.socket_path)
+            conn.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+            rows, dim = MATRIX_HEADER.unpack(_recv_exact(conn, MATRIX_HEADER.size))
+            if rows == ERROR_MARKER:
+                raise RuntimeError(_recv_exact(conn, dim).decode("utf-8"))
+            data = _recv_exact(conn, rows * dim * 4)
+        return np.frombuffer(data, dtype=np.float32).reshape(rows, dim)
+
+
+class EmbeddingBatcher:
+    """
+    Собирает одновременные запросы на эмбеддинг в один вызов `encode`.
+    Первый запрос открывает окно длиной `window_ms`; все, кто успел прийти
+    за это время (но не больше `max_batch`), кодируются одним батчем в пуле потоков.
+    """
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], executor: ThreadPoolExecutor,
+                 window_ms: float, max_batch: int):
+        self._encode = encode
+        self._executor = executor
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: set = set()
+        self.batches = 0
+        self.texts = 0
+
+    async def embed(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        texts = [text for text, _ in batch]
+        self.batches += 1
+        self.texts += len(texts)
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(self._executor, self._encode, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0,
+        }
+
+
+def normalize_query(text: str) -> str:
+    """Приводит запрос к каноническому виду: регистр и лишние пробелы не влияют на ключ кэша."""
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов запросов по нормализованному тексту.
+    Первый уровень — LRU в памяти процесса, второй (если задан `cache_dir`) —
+    файл векторов float32, читаемый через np.memmap, и журнал ключей `ключ строка`.
+    Память используется только из event loop; дисковый уровень (`get_disk`/`set_disk`)
+    блокирует поток и вызывается через пул потоков.
+    В meta.json хранится имя модели: при его смене дисковый кэш очищается.
+    """
+    META_FILE = "meta.json"
+    KEYS_FILE = "keys.txt"
+    VECTORS_FILE = "vectors.f32"
+
+    def __init__(self, model_name: str, max_entries: int, cache_dir: Optional[str] = None,
+                 disk_max_entries: int = 0):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.disk_max_entries = disk_max_entries
+
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._disk_rows: Dict[str, int] = {}
+        self._dim: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            try:
+                self._open_disk()
+            except OSError as e:
+                logger.warning(f"Дисковый кэш эмбеддингов в {cache_dir} недоступен: {e}")
+                self.cache_dir = None
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        return hashlib.sha1(normalize_query(text).encode("utf-8")).hexdigest()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def _open_disk(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta = {}
+        if os.path.exists(self._path(self.META_FILE)):
+            with open(self._path(self.META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+        if meta.get("model_name") != self.model_name:
+            if meta:
+                logger.info(
+                    f"Модель эмбеддингов сменилась ({meta.get('model_name')} -> {self.model_name}), дисковый кэш очищен.")
+            for name in (self.KEYS_FILE, self.VECTORS_FILE):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self._write_meta(None)
+            return
+
+        self._dim = meta.get("dim")
+        if not self._dim or not os.path.exists(self._path(self.KEYS_FILE)):
+            return
+        rows = os.path.getsize(self._path(self.VECTORS_FILE)) // (self._dim * 4)
+        with open(self._path(self.KEYS_FILE), encoding="utf-8") as f:
+            for line in f:
+                key, _, row = line.strip().partition(" ")
+                # Строка без вектора — след прерванной записи.
+                if row.isdigit() and int(row) < rows:
+                    self._disk_rows[key] = int(row)
+        self._remap(rows)
+        logger.info(f"Дисковый кэш эмбеддингов: {len(self._disk_rows)} векторов.")
+
+    def _write_meta(self, dim: Optional[int]):
+        with open(self._path(self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"model_name": self.model_name, "dim": dim}, f)
+
+    def _remap(self, rows: int):
+        self._vectors = np.memmap(
+            self._path(self.VECTORS_FILE), dtype=np.float32, mode="r", shape=(rows, self._dim)
+        ) if rows else None
+
+    def get_memory(self, text: str) -> Optional[np.ndarray]:
+        """Поиск в LRU памяти; вызывается только из event loop и не блокируется."""
+        key = self.make_key(text)
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+        return vector
+
+    def set_memory(self, text: str, vector: np.ndarray):
+        key = self.make_key(text)
+        self._memory[key] = np.asarray(vector, dtype=np.float32)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_disk(self, text: str) -> Optional[np.ndarray]:
+        """Поиск в дисковом уровне (memmap может перечитываться) — выполнять в пуле потоков."""
+        key = self.make_key(text)
+        with self._lock:
+            row = self._disk_rows.get(key)
+            if row is None:
+                return None
+            if self._vectors is None or row >= len(self._vectors):
+                self._remap(os.path.getsize(self._path(self.VECTORS_FILE)) // (self._dim * 4))
+            self.disk_hits += 1
+            return np.array(self._vectors[row])
+
+    def record_miss(self):
+        self.misses += 1
+
+    def set_disk(self, text: str, vector: np.ndarray):
+        """Дописывает вектор в дисковый уровень (под межпроцессной блокировкой) — выполнять в пуле потоков."""
+        key = self.make_key(text)
+        with self._lock:
+            if key in self._disk_rows or len(self._disk_rows) >= self.disk_max_entries:
+                return
+            try:
+                self._append_to_disk(key, np.asarray(vector, dtype=np.float32))
+            except OSError as e:
+                logger.warning(f"Не удалось записать эмбеддинг в дисковый кэш: {e}")
+
+    def _append_to_disk(self, key: str, vector: np.ndarray):
+        if self._dim is None:
+            self._dim = int(vector.shape[-1])
+            self._write_meta(self._dim)
+        # Файлы могут дописывать несколько воркеров uvicorn, номер строки берется под блокировкой.
+        with open(self._path(self.VECTORS_FILE), "ab") as vectors:
+            fcntl.flock(vectors, fcntl.LOCK_EX)
+            try:
+                row = vectors.seek(0, os.SEEK_END) // (self._dim * 4)
+                vectors.write(vector.tobytes())
+                vectors.flush()
+                with open(self._path(self.KEYS_FILE), "a", encoding="utf-8") as keys:
+                    keys.write(f"{key} {row}\n")
+            finally:
+                fcntl.flock(vectors, fcntl.LOCK_UN)
+        self._disk_rows[key] = row
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "disk_entries": len(self._disk_rows),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0,
+        }
+
+
+class KnowledgeBase:
+    """
+    Ленивый потокобезопасный реестр ресурсов RAG: модели эмбеддингов и коллекции ChromaDB.
+    Ничего не загружается при импорте — только при первом обращении или в фоновом прогреве.
+    """
+    def __init__(self, model_name: str, db_path: str, collection_name: str, socket_path: Optional[str] = None,
+                 reranker_model_name: Optional[str] = None):
+        self.model_name = model_name
+        self.reranker_model_name = reranker_model_name
+        self.db_path = db_path
+        self.collection_name = collection_name
+        self._remote = RemoteEmbeddingClient(socket_path) if socket_path else None
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._collection = None
+        self._collection_loaded = False
+        self._collection_lock = threading.Lock()
+        self._reranker = None
+        self._reranker_lock = threading.Lock()
+        self._lexical_index: Optional[LexicalIndex] = None
+        self._lexical_loaded = False
+        self._lexical_lock = threading.Lock()
+
+        # Кодирование и поиск в ChromaDB — синхронные CPU/дисковые операции, поэтому выполняются вне event loop.
+        self._executor = ThreadPoolExecutor(max_workers=settings.EMBEDDING_THREADS, thread_name_prefix="kb")
+        self.batcher = EmbeddingBatcher(
+            self.encode, self._executor, settings.EMBEDDING_BATCH_WINDOW_MS, settings.EMBEDDING_MAX_BATCH_SIZE
+        )
+        self.cache = EmbeddingCache(
+            model_name, settings.EMBEDDING_CACHE_MAX_ENTRIES, settings.EMBEDDING_CACHE_DIR,
+            settings.EMBEDDING_CACHE_DISK_MAX_ENTRIES,
+        )
+
+    def get_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    logger.info(f"Загрузка embedding-модели '{self.model_name}'...")
+                    self._model = SentenceTransformer(self.model_name)
+                    logger.info("Embedding-модель загружена.")
+        return self._model
+
+    def get_collection(self):
+        """Возвращает коллекцию ChromaDB или None, если база знаний не создана."""
+        if not self._collection_loaded:
+            with self._collection_lock:
+                if not self._collection_loaded:
+                    import chromadb
+
+                    try:
+                        client = chromadb.PersistentClient(path=self.db_path)
+                        self._collection = client.get_collection(name=self.collection_name)
+                        logger.info(f"Успешное подключение к коллекции '{self.collection_name}' в ChromaDB по пути: {self.db_path}")
+                    except Exception as e:
+                        logger.warning(
+                            f"Коллекция ChromaDB '{self.collection_name}' не найдена по пути: {self.db_path}. RAG будет отключен. Ошибка: {e}")
+                    self._collection_loaded = True
+        return self._collection
+
+    def get_lexical_index(self) -> Optional[LexicalIndex]:
+        """BM25-индекс, построенный `prepare_db` рядом с коллекцией, или None, если его нет."""
+        if not self._lexical_loaded:
+            with self._lexical_lock:
+                if not self._lexical_loaded:
+                    path = os.path.join(self.db_path, LEXICAL_INDEX_FILE)
+                    try:
+                        self._lexical_index = LexicalIndex.load(path)
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.warning(f"Не удалось загрузить лексический индекс {path}: {e}")
+                    if self._lexical_index is None:
+                        logger.warning(f"Лексический индекс не найден по пути: {path}. Поиск только по векторам.")
+                    self._lexical_loaded = True
+        return self._lexical_index
+
+    def get_reranker(self):
+        """Возвращает CrossEncoder для переранжирования или None, если он не настроен."""
+        if self.reranker_model_name is None:
+            return None
+        if self._reranker is None:
+            with self._reranker_lock:
+                if self._reranker is None:
+                    from sentence_transformers import CrossEncoder
+
+                    logger.info(f"Загрузка модели переранжирования '{self.reranker_model_name}'...")
+                    self._reranker = CrossEncoder(self.reranker_model_name, device="cpu")
+                    logger.info("Модель переранжирования загружена.")
+        return self._reranker
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if self._remote is not None:
+            return self._remote.encode(texts)
+        return self.get_model().encode(texts)
+
+    async def aget_collection(self):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.get_collection)
+
+    async def aget_lexical_index(self) -> Optional[LexicalIndex]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.get_lexical_index)
+
+    async def embed(self, text: str) -> np.ndarray:
+        vector = self.cache.get_memory(text)
+        if vector is not None:
+            return vector
+        if self.cache.cache_dir:
+            vector = await asyncio.to_thread(self.cache.get_disk, text)
+        if vector is None:
+            self.cache.record_miss()
+            vector = await self.batcher.embed(normalize_query(text))
+            if self.cache.cache_dir:
+                # Запись на диск (с ожиданием flock других воркеров) не задерживает ответ.
+                asyncio.get_running_loop().run_in_executor(None, self.cache.set_disk, text, vector)
+        self.cache.set_memory(text, vector)
+        return vector
+
+    async def embed_many(self, texts: List[str]) -> np.ndarray:
+        """Кодирует набор текстов одним вызовом в пуле потоков, минуя кэш и микробатчинг."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.encode, texts)
+
+    async def query(self, collection, embedding: np.ndarray, n_results: int, include: List[str]) -> Dict[str, Any]:
+        def run():
+            return collection.query(query_embeddings=[embedding.tolist()], n_results=n_results, include=include)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    async def get_chunks(self, collection, ids: List[str], include: List[str]) -> Dict[str, Any]:
+        def run():
+            return collection.get(ids=ids, include=include)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    async def rerank(self, query: str, texts: List[str]) -> Optional[np.ndarray]:
+        """Оценки релевантности пар (запрос, текст) от CrossEncoder или None, если переранжирование выключено."""
+        if self.reranker_model_name is None:
+            return None
+
+        def run():
+            return np.asarray(self.get_reranker().predict([(query, text) for text in texts]))
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    def _warm_up(self):
+        self.get_collection()
+        self.get_lexical_index()
+        if self._remote is None:
+            self.get_model()
+        self.get_reranker()
+
+    async def warm_up(self):
+        try:
+            await asyncio.to_thread(self._warm_up)
+        except Exception as e:
+            logger.error(f"Не удалось прогреть базу знаний: {e}", exc_info=True)
+
+    @property
+    def ready(self) -> bool:
+        model_ready = self._remote is not None or self._model is not None
+        return model_ready and self._collection_loaded
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "model_name": self.model_name,
+            "embedding_backend": "remote" if self._remote is not None else "local",
+            "model_loaded": self._model is not None,
+            "collection_loaded": self._collection_loaded,
+            "rag_enabled": self._collection is not None,
+            "lexical_index_loaded": self._lexical_index is not None,
+            "reranker_loaded": self._reranker is not None,
+            "batching": self.batcher.stats(),
+            "embedding_cache": self.cache.stats(),
+        }
+
+
+knowledge_base = KnowledgeBase(
+    model_name=settings.EMBEDDING_MODEL_NAME,
+    db_path=settings.CHROMA_DB_PATH,
+    collection_name=settings.KB_COLLECTION_NAME,
+    socket_path=settings.EMBEDDING_SOCKET_PATH,
+    reranker_model_name=settings.RAG_RERANKER_MODEL,
+)
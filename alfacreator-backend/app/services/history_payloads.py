@@ -0,0 +1,78 @@
+import asyncio
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud
+from app.core.config import settings
+from app.schemas import history as history_schema
+
+# Ключ заглушки, которая хранится в History вместо вынесенного содержимого.
+PAYLOAD_REF_KEY = "$payload"
+PAYLOAD_FIELDS = ("input_data", "output_data")
+
+
+def payload_ref(value: Any) -> Optional[str]:
+    """Хеш вынесенного содержимого, если поле — заглушка, иначе None."""
+    if isinstance(value, dict) and PAYLOAD_REF_KEY in value:
+        return value[PAYLOAD_REF_KEY]
+    return None
+
+
+def offload_payloads(rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Заменяет крупные поля записей истории заглушками `{"$payload": sha256, "size": байты}`
+    и возвращает новые строки вместе со сжатым содержимым для таблицы history_payloads.
+    Исходные строки не изменяются: при ошибке записи в журнал уходит полная версия.
+    """
+    offloaded, payloads = [], {}
+    for row in rows:
+        row = dict(row)
+        for field in PAYLOAD_FIELDS:
+            value = row.get(field)
+            if value is None:
+                continue
+            raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            if len(raw) < settings.HISTORY_PAYLOAD_OFFLOAD_BYTES:
+                continue
+            digest = hashlib.sha256(raw).hexdigest()
+            if digest not in payloads:
+                payloads[digest] = {
+                    "digest": digest,
+                    "codec": "gzip",
+                    "data": gzip.compress(raw, compresslevel=settings.HISTORY_PAYLOAD_COMPRESSION_LEVEL),
+                    "size": len(raw),
+                }
+            row[field] = {PAYLOAD_REF_KEY: digest, "size": len(raw)}
+        offloaded.append(row)
+    return offloaded, list(payloads.values())
+
+
+def _decompress(payloads) -> Dict[str, Any]:
+    return {payload.digest: json.loads(gzip.decompress(payload.data)) for payload in payloads}
+
+
+async def inflate_entries(db: AsyncSession, entries) -> List[history_schema.History]:
+    """
+    Подставляет в записи истории вынесенное содержимое. Распаковка идет в отдельном
+    потоке и только для записей со ссылками; остальные отдаются как есть.
+    """
+    items = [history_schema.History.model_validate(entry) for entry in entries]
+    digests = {ref for item in items for ref in (payload_ref(getattr(item, field)) for field in PAYLOAD_FIELDS) if ref}
+    if not digests:
+        return items
+
+    payloads = await crud.get_history_payloads(db, list(digests))
+    contents = await asyncio.to_thread(_decompress, payloads)
+    inflated = []
+    for item in items:
+        update = {}
+        for field in PAYLOAD_FIELDS:
+            ref = payload_ref(getattr(item, field))
+            if ref in contents:
+                update[field] = contents[ref]
+        inflated.append(item.model_copy(update=update) if update else item)
+    return inflated
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from app import crud
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+from app.schemas import history as history_schema
+from app.services.history_payloads import offload_payloads
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """
+    Отложенная (write-behind) запись истории. Генерации только ставят запись
+    в очередь и сразу отвечают пользователю; фоновая задача вставляет записи
+    пачками — одной транзакцией каждые `flush_interval_ms` или по `batch_size` строк.
+
+    Крупные input_data/output_data перед вставкой сжимаются в таблицу
+    history_payloads (см. `history_payloads.offload_payloads`).
+
+    Если БД недоступна, очередь переполнена или при остановке не удалось дописать
+    остаток, записи сохраняются в JSONL-журнал `fallback_path` и переносятся в БД
+    при следующем запуске.
+    """
+    def __init__(self, batch_size: int, flush_interval_ms: float, max_queue: int, fallback_path: str,
+                 shutdown_timeout: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue = max_queue
+        self.fallback_path = fallback_path
+        self.shutdown_timeout = shutdown_timeout
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batch: List[Dict[str, Any]] = []
+        self.written = 0
+        self.batches = 0
+        self.spilled = 0
+
+    def submit(self, user_id: int, entry: history_schema.HistoryCreate):
+        """Ставит запись истории в очередь без ожидания БД."""
+        row = {**entry.model_dump(), "user_id": user_id, "created_at": datetime.now(timezone.utc)}
+        if self._task is None or self._task.done():
+            logger.warning("Запись истории не запущена, запись сохранена в журнал.")
+            self._spill([row])
+        elif self._queue.qsize() >= self.max_queue:
+            logger.warning("Очередь записи истории переполнена, запись сохранена в журнал.")
+            self._spill([row])
+        else:
+            self._queue.put_nowait(row)
+
+    def _spill(self, rows: List[Dict[str, Any]]):
+        with open(self.fallback_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps({**row, "created_at": row["created_at"].isoformat()}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.spilled += len(rows)
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> bool:
+        try:
+            # Сжатие крупных полей — вне цикла событий; в журнал при ошибке уходят исходные строки.
+            offloaded, payloads = await asyncio.to_thread(offload_payloads, rows)
+            async with AsyncSessionLocal() as db:
+                await crud.create_history_entries(db, offloaded, payloads)
+        except Exception as e:
+            logger.error(f"Не удалось записать {len(rows)} записей истории, они сохранены в журнал: {e}")
+            self._spill(rows)
+            return False
+        self.written += len(rows)
+        self.batches += 1
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            self._batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                self._batch.append(item)
+            await self._write(self._batch)
+            self._batch = []
+
+    async def _replay_journal(self):
+        """Переносит в БД записи, оставшиеся в журнале после прошлого запуска."""
+        if not os.path.exists(self.fallback_path):
+            return
+        # Переименование атомарно: при нескольких воркерах uvicorn журнал заберет только один.
+        replay_path = f"{self.fallback_path}.{os.getpid()}.replay"
+        try:
+            os.replace(self.fallback_path, replay_path)
+        except FileNotFoundError:
+            return
+
+        with open(replay_path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        for row in rows:
+            row["created_at"] = datetime.fromisoformat(row["created_at"])
+        logger.info(f"Перенос {len(rows)} записей истории из журнала {self.fallback_path}...")
+        for start in range(0, len(rows), self.batch_size):
+            await self._write(rows[start:start + self.batch_size])
+        os.remove(replay_path)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        await self._replay_journal()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает очередь в БД; то, что не успело записаться за `shutdown_timeout`, уходит в журнал."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(_STOP)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            pending = self._batch + [item for item in self._drain() if item is not _STOP]
+            if pending:
+                logger.warning(f"Запись истории не завершилась за {self.shutdown_timeout} с, "
+                               f"{len(pending)} записей сохранены в журнал.")
+                self._spill(pending)
+        self._task = None
+
+    def _drain(self) -> List[Any]:
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "written": self.written,
+            "batches": self.batches,
+            "spilled_to_journal": self.spilled,
+        }
+
+
+history_writer = HistoryWriter(
+    batch_size=settings.HISTORY_BATCH_SIZE,
+    flush_interval_ms=settings.HISTORY_FLUSH_INTERVAL_MS,
+    max_queue=settings.HISTORY_MAX_QUEUE,
+    fallback_path=settings.HISTORY_FALLBACK_PATH,
+    shutdown_timeout=settings.HISTORY_SHUTDOWN_TIMEOUT_SECONDS,
+)
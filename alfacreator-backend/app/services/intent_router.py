@@ -0,0 +1,203 @@
+import asyncio
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.services.embedding_service import knowledge_base, normalize_query
+from app.services.lexical_index import stem_terms
+
+# Инструменты, которым нужны параметры из текста запроса (описание товара, реквизиты документа).
+# Их извлекает только LLM, поэтому роутер в таких случаях всегда уступает ему.
+LLM_ONLY_TOOLS = {"generate_promo", "generate_document"}
+LLM_ONLY_KEYWORDS = re.compile(r"пост|реклам|промо|договор|сч[её]т|акт\b|документ|шаблон")
+
+NAVIGATE_RE = re.compile(
+    r"^(?:где|как)\s+(?:мне\s+)?(?:найти|открыть|посмотреть|попасть|перейти|находится|находятся)\s+"
+    r"(?:в\s+|во\s+|на\s+|к\s+)?(?:раздел\s+|вкладк[уа]\s+)?(?P<feature>.+)$"
+)
+KNOWLEDGE_RE = re.compile(
+    r"^(?:что\s+такое|что\s+значит|что\s+означает|кто\s+такой|кто\s+такая|какие\s+обязанности|"
+    r"как\s+рассчитать|как\s+посчитать|как\s+считается|расскажи\s+(?:о|об|про)|в\s+ч[её]м\s+разница)\b"
+)
+
+# Разделы интерфейса, на которые может вести navigate_ui: ключи knowledge_base/ui_guide.json
+# и вкладки фронтенда. Остальные "где найти ..." (подписчиков, клиентов) — вопросы по SMM, а не навигация.
+UI_SECTIONS: Dict[str, List[str]] = {
+    "dashboard": ["дашборд", "главный экран", "главная страница"],
+    "analytics": ["аналитика", "аналитика csv", "отчеты", "загрузка csv"],
+    "smart_analytics": ["умная аналитика", "контент-план"],
+    "promo": ["генератор промо", "генерация промо"],
+    "documents": ["шаблоны", "документы", "генерация документов", "генератор документов"],
+    "history": ["история", "история запросов", "история генераций"],
+    "profile": ["профиль", "настройки профиля", "личный кабинет"],
+}
+# Слова вокруг названия раздела, не меняющие его смысл: "историю в приложении", "отчеты на сайте".
+UI_FILLER_STEMS = set(stem_terms("в во на мне моя мой мои приложение приложении сайте меню раздел вкладка страница"))
+
+INTENT_EXEMPLARS: Dict[str, List[str]] = {
+    "search_knowledge_base": [
+        "что такое охват",
+        "что такое вовлеченность аудитории",
+        "как рассчитать ER",
+        "какие обязанности у SMM-менеджера",
+        "как проходит онбординг нового сотрудника",
+        "сколько дней отпуска положено",
+        "чем отличается охват от показов",
+        "как часто публиковать посты в соцсетях",
+    ],
+    "navigate_ui": [
+        "где найти историю",
+        "где посмотреть аналитику",
+        "как открыть дашборд",
+        "где находится раздел отчетов",
+        "как перейти к генерации документов",
+    ],
+    "generate_promo": [
+        "придумай пост про наш новый кофе",
+        "напиши рекламу для кофейни",
+        "сделай промо для распродажи",
+    ],
+    "generate_document": [
+        "сделай счет для клиента",
+        "составь договор оказания услуг",
+        "нужен акт выполненных работ",
+    ],
+    "greet": [
+        "здравствуйте, что ты умеешь",
+        "привет, чем ты можешь помочь",
+    ],
+}
+
+
+def _is_russian(text: str) -> bool:
+    letters = re.findall(r"[a-zа-яё]", text)
+    return bool(letters) and sum("а" <= ch <= "я" or ch == "ё" for ch in letters) / len(letters) >= 0.5
+
+
+_UI_SECTION_STEMS = [
+    (section, frozenset(stem_terms(alias)))
+    for section, aliases in UI_SECTIONS.items() for alias in aliases
+]
+
+
+def ui_section(feature: str) -> Optional[str]:
+    """Раздел интерфейса, если `feature` — его название (с точностью до словоформ и служебных слов)."""
+    stems = set(stem_terms(feature)) - UI_FILLER_STEMS
+    for section, alias_stems in _UI_SECTION_STEMS:
+        if stems == alias_stems:
+            return section
+    return None
+
+
+def _navigation_feature(normalized: str) -> Optional[str]:
+    match = NAVIGATE_RE.match(normalized)
+    if match is None:
+        return None
+    feature = match.group("feature").rstrip("?!. ")
+    return feature if ui_section(feature) else None
+
+
+def _tool_call(tool_name: str, query: str, normalized: str) -> Optional[Dict[str, Any]]:
+    if tool_name == "navigate_ui":
+        # Без известного раздела ответ "откройте вкладку" бесполезен — решение остается за LLM.
+        feature = _navigation_feature(normalized)
+        if feature is None:
+            return None
+        return {"tool_name": "navigate_ui", "parameters": {"feature_name": feature}}
+    if tool_name == "search_knowledge_base":
+        return {"tool_name": "search_knowledge_base", "parameters": {"query": query}}
+    return {"tool_name": tool_name, "parameters": {}}
+
+
+class IntentRouter:
+    """
+    Быстрый локальный выбор инструмента для чата без обращения к LLM.
+    Сначала срабатывают правила (навигация — только к известному разделу `UI_SECTIONS`,
+    база знаний — только при точном совпадении с термином), затем поиск ближайшего
+    примера среди эмбеддингов `INTENT_EXEMPLARS`. Решение принимается только
+    при высокой уверенности; иначе возвращается None и инструмент выбирает LLM.
+    """
+    def __init__(self, exemplars: Dict[str, List[str]], min_similarity: float, min_margin: float):
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self._labels = [label for label, texts in exemplars.items() for _ in texts]
+        self._texts = [normalize_query(text) for texts in exemplars.values() for text in texts]
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_lock = asyncio.Lock()
+        self.routed: Dict[str, int] = {}
+        self.fallbacks = 0
+
+    async def _exemplar_matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            async with self._matrix_lock:
+                if self._matrix is None:
+                    vectors = np.asarray(await knowledge_base.embed_many(self._texts), dtype=np.float32)
+                    self._matrix = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return self._matrix
+
+    async def _nearest_intent(self, query: str) -> Optional[str]:
+        matrix = await self._exemplar_matrix()
+        vector = np.asarray(await knowledge_base.embed(query), dtype=np.float32)
+        similarities = matrix @ (vector / (np.linalg.norm(vector) or 1))
+
+        best_by_label: Dict[str, float] = {}
+        for label, similarity in zip(self._labels, similarities):
+            best_by_label[label] = max(best_by_label.get(label, -1.0), float(similarity))
+        ranked = sorted(best_by_label.items(), key=lambda item: item[1], reverse=True)
+        (label, best), runner_up = ranked[0], ranked[1][1] if len(ranked) > 1 else -1.0
+        if best < self.min_similarity or best - runner_up < self.min_margin:
+            return None
+        return label
+
+    def _record(self, tool_call: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if tool_call is None:
+            self.fallbacks += 1
+        else:
+            name = tool_call["tool_name"]
+            self.routed[name] = self.routed.get(name, 0) + 1
+        return tool_call
+
+    async def route(self, query: str) -> Optional[Dict[str, Any]]:
+        normalized = normalize_query(query)
+        # Запросы о постах и документах требуют извлечения параметров, а нерусские — перевода для поиска.
+        if LLM_ONLY_KEYWORDS.search(normalized) or not _is_russian(normalized):
+            return self._record(None)
+
+        if _navigation_feature(normalized):
+            return self._record(_tool_call("navigate_ui", query, normalized))
+
+        # Вопрос о термине уходит в базу знаний без LLM, только если термин в ней точно есть.
+        lexical_index = await knowledge_base.aget_lexical_index()
+        if lexical_index is not None:
+            knowledge_match = KNOWLEDGE_RE.match(normalized)
+            term = normalized[knowledge_match.end():] if knowledge_match else query
+            if lexical_index.lookup_term(term):
+                return self._record(_tool_call("search_knowledge_base", query, normalized))
+
+        try:
+            label = await self._nearest_intent(query)
+        except Exception as e:
+            logger.warning(f"Роутер намерений: эмбеддинги недоступны, выбор остается за LLM: {e}")
+            return self._record(None)
+        if label is None or label in LLM_ONLY_TOOLS:
+            return self._record(None)
+        return self._record(_tool_call(label, query, normalized))
+
+    def stats(self) -> Dict[str, Any]:
+        routed = sum(self.routed.values())
+        total = routed + self.fallbacks
+        return {
+            "routed": self.routed,
+            "llm_fallbacks": self.fallbacks,
+            "routed_share": round(routed / total, 3) if total else 0,
+        }
+
+
+intent_router = IntentRouter(
+    INTENT_EXEMPLARS,
+    min_similarity=settings.INTENT_ROUTER_MIN_SIMILARITY,
+    min_margin=settings.INTENT_ROUTER_MIN_MARGIN,
+)
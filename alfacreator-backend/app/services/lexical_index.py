@@ -0,0 +1,99 @@
+"""
+Лексический индекс базы знаний: BM25 по чанкам и словарь точных терминов глоссария.
+Строится в `prepare_db` рядом с коллекцией ChromaDB; приложение загружает его лениво.
+Модуль не зависит от настроек приложения, чтобы его можно было импортировать из офлайн-скрипта.
+"""
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+LEXICAL_INDEX_FILE = "kb_lexical.json"
+TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+# Усечение до префикса — дешевая замена стеммингу: "охват", "охвата", "охватом" дают один терм.
+STEM_PREFIX = 5
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Слова вопроса, которые не входят в сам термин: "что такое ER?" -> "er".
+QUESTION_WORDS = {"что", "такое", "это", "значит", "означает", "термин", "определение", "расскажи", "про", "о", "об"}
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def stem_terms(text: str) -> List[str]:
+    return [token[:STEM_PREFIX] for token in tokenize(text)]
+
+
+def term_aliases(term: str) -> Set[str]:
+    """Варианты написания термина: "ER (Engagement Rate)" -> {"er engagement rate", "er", "engagement rate"}."""
+    variants = [term, re.sub(r"\(.*?\)", " ", term), *re.findall(r"\((.*?)\)", term)]
+    return {alias for alias in (" ".join(tokenize(variant)) for variant in variants) if alias}
+
+
+def query_term_key(query: str) -> str:
+    return " ".join(token for token in tokenize(query) if token not in QUESTION_WORDS)
+
+
+def build_lexical_index(documents: Iterable[Tuple[str, str, Optional[str]]]) -> dict:
+    """Строит индекс из троек (id чанка, текст, термин глоссария или None)."""
+    ids, lengths = [], []
+    postings: Dict[str, List[List[int]]] = defaultdict(list)
+    terms: Dict[str, List[str]] = defaultdict(list)
+    for doc_id, text, term in documents:
+        position = len(ids)
+        ids.append(doc_id)
+        counts = Counter(stem_terms(text))
+        lengths.append(sum(counts.values()))
+        for token, frequency in counts.items():
+            postings[token].append([position, frequency])
+        if term:
+            for alias in term_aliases(term):
+                terms[alias].append(doc_id)
+    return {"ids": ids, "lengths": lengths, "postings": postings, "terms": terms}
+
+
+def save_lexical_index(path: str, index: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class LexicalIndex:
+    def __init__(self, data: dict):
+        self.ids: List[str] = data["ids"]
+        self.lengths: List[int] = data["lengths"]
+        self.postings: Dict[str, List[List[int]]] = data["postings"]
+        self.terms: Dict[str, List[str]] = data["terms"]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 1.0
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LexicalIndex"]:
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def lookup_term(self, query: str) -> List[str]:
+        """id чанков глоссария, если запрос — это точное название термина."""
+        return self.terms.get(query_term_key(query), [])
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Top-k чанков по BM25 в виде пар (id, балл)."""
+        total = len(self.ids)
+        scores: Dict[int, float] = defaultdict(float)
+        for token in set(stem_terms(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self.lengths[position] / self.avg_length
+                scores[position] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[position], score) for position, score in best]
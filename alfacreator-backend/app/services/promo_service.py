@@ -1,13 +1,13 @@
 import json
 import re
 from loguru import logger
-from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import AsyncIterator, List
 
 from app.core.llm_client import llm_client
+from app.core.streaming import StreamEvent
 from app.schemas.promo import PromoRequest
 from app.schemas import history as history_schema
-from app import crud
+from app.services.history_writer import history_writer
 
 
 def _parse_llm_response_safely(response_str: str, user_id: int) -> List[str]:
@@ -40,12 +40,13 @@ def _parse_llm_response_safely(response_str: str, user_id: int) -> List[str]:
     return final_results
 
 
-async def generate_promo_logic(
-        request: PromoRequest,
-        db: AsyncSession,
-        user_id: int
-) -> list[str]:
-    prompt = (
+def _results_validator(user_id: int):
+    """Проверка ответа для кэша LLM: кэшируется только ответ, из которого извлеклись посты."""
+    return lambda response_str: bool(_parse_llm_response_safely(response_str, user_id))
+
+
+def _build_promo_prompt(request: PromoRequest) -> str:
+    return (
         "Ты — SMM-копирайтер. Создай 3 уникальных рекламных поста.\n"
         "Информация:\n"
         f"- Продукт: {request.product_description}\n"
@@ -58,22 +59,65 @@ async def generate_promo_logic(
         "Пример ответа: [\"Первый пост...\", \"Второй пост...\", \"Третий пост...\"]"
     )
 
+
+def _save_promo_history(user_id: int, request: PromoRequest, results: List[str]):
+    history_entry_data = history_schema.HistoryCreate(
+        request_type="promo",
+        input_data=request.model_dump(),
+        output_data={"results": results}
+    )
+    history_writer.submit(user_id, history_entry_data)
+
+
+async def generate_promo_logic(
+        request: PromoRequest,
+        user_id: int
+) -> list[str]:
+    prompt = _build_promo_prompt(request)
+
     try:
-        response_str = await llm_client.generate_json_response(prompt)
+        response_str = await llm_client.generate_json_response(
+            prompt, use_case="promo", user_id=user_id,
+            validate=_results_validator(user_id),
+        )
         results = _parse_llm_response_safely(response_str, user_id)
 
         if not results:
             raise ValueError("LLM returned an empty or unparsable result, possibly due to safety filters.")
 
-        history_entry_data = history_schema.HistoryCreate(
-            request_type="promo",
-            input_data=request.model_dump(),
-            output_data={"results": results}
-        )
-        await crud.create_history_entry(db=db, user_id=user_id, entry=history_entry_data)
+        _save_promo_history(user_id, request, results)
 
         return results
 
     except Exception as e:
         logger.error(f"Error in promo generation logic for user {user_id}: {e}", exc_info=True)
         raise
+
+
+def stream_promo_logic(request: PromoRequest, user_id: int) -> AsyncIterator[StreamEvent]:
+    """
+    Потоковый вариант `generate_promo_logic`: отдает сырые токены JSON-ответа модели,
+    а в финальном событии `done` — разобранный список постов. Загрузка очереди
+    к LLM проверяется до начала ответа, чтобы отказ вернулся статусом 429/503.
+    """
+    prompt = _build_promo_prompt(request)
+    llm_client.scheduler.check_admission("promo", user_id)
+    return _stream_promo(prompt, request, user_id)
+
+
+async def _stream_promo(prompt: str, request: PromoRequest, user_id: int) -> AsyncIterator[StreamEvent]:
+    parts = []
+    async for chunk in llm_client.stream_response(
+            prompt, format='json', use_case="promo", user_id=user_id,
+            validate=_results_validator(user_id),
+    ):
+        parts.append(chunk)
+        yield "token", {"text": chunk}
+
+    results = _parse_llm_response_safely("".join(parts), user_id)
+    if not results:
+        raise ValueError("LLM returned an empty or unparsable result, possibly due to safety filters.")
+
+    _save_promo_history(user_id, request, results)
+
+    yield "done", {"results": results}
@@ -1,32 +1,21 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
 from loguru import logger
 import json
 import re
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
 from pydantic import ValidationError
+from fastapi import HTTPException
 
+from app.core.config import settings
 from app.core.llm_client import llm_client, LLMClient
-from app.database import AsyncSessionLocal
+from app.core.streaming import StreamEvent
 from app.services import promo_service, document_service
 from app.schemas import promo as promo_schema
 from app.schemas import documents as document_schema
+from app.services.embedding_service import knowledge_base
+from app.services.intent_router import intent_router
+from app.services.retrieval_service import retrieve_context
 
-embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-
-DB_PATH = "/app/chroma_db"
-client = chromadb.PersistentClient(path=DB_PATH)
-
-try:
-    collection = client.get_collection(name="smm_assistant_kb")
-    RAG_ENABLED = True
-    logger.info(f"Успешное подключение к коллекции 'smm_assistant_kb' в ChromaDB по пути: {DB_PATH}")
-
-except Exception as e:
-    RAG_ENABLED = False
-    logger.warning(
-        f"Коллекция ChromaDB 'smm_assistant_kb' не найдена по пути: {DB_PATH}. RAG будет отключен. Ошибка: {e}")
-
-L2_RELEVANCE_THRESHOLD = 5
 PROFANITY_KEYWORDS = {"мат", "дурак", "идиот"}
 SMALL_TALK_PHRASES = {
     "привет": "Здравствуйте! Я Альфа-Ассистент. Чем могу помочь?",
@@ -52,9 +41,17 @@ def _is_gibberish(text: str) -> bool:
     return False
 
 
+PROMPT_LEAK_WORDS = ["контекст", "инструкц", "согласно предоставленному", "основываясь на"]
+# Столько последних символов потока придерживается: в них может начинаться еще не дописанное стоп-слово.
+PROMPT_LEAK_HOLDBACK = max(len(word) for word in PROMPT_LEAK_WORDS) - 1
+
+
+def _has_prompt_leak(text: str) -> bool:
+    return any(leak in text.lower() for leak in PROMPT_LEAK_WORDS)
+
+
 def censor_output(text: str) -> str:
-    prompt_leak_words = ["контекст", "инструкц", "согласно предоставленному", "основываясь на"]
-    if any(leak in text.lower() for leak in prompt_leak_words):
+    if _has_prompt_leak(text):
         logger.warning(f"ОБНАРУЖЕНА УТЕЧКА ПРОМПТА: '{text}'. Ответ будет заменен.")
         return "К сожалению, я не нашел точной информации по вашему вопросу."
     return text
@@ -110,95 +107,173 @@ SYSTEM_PROMPT_WITH_TOOLS = f"""
 """
 
 
-async def get_bot_response(query: str, llm_client: LLMClient, user_id: int) -> str:
-    logger.info(f"Получен запрос от пользователя ID={user_id}: '{query}'")
-    normalized_query = query.strip().lower()
-
+def _prefilter_reply(normalized_query: str) -> Optional[str]:
     if _is_gibberish(normalized_query): return RESPONSE_GIBBERISH
     if any(profanity in normalized_query for profanity in PROFANITY_KEYWORDS): return RESPONSE_PROFANITY
     if normalized_query in SMALL_TALK_PHRASES: return SMALL_TALK_PHRASES[normalized_query]
+    return None
+
+
+def _parse_tool_call(response_str: str) -> dict:
+    json_start = response_str.find('{')
+    json_end = response_str.rfind('}')
+    if json_start == -1 or json_end == -1: raise ValueError("Не найден JSON в ответе LLM")
+    clean_json_str = response_str[json_start:json_end + 1]
+    return json.loads(clean_json_str)
+
+
+def _is_tool_call(response_str: str) -> bool:
+    tool_call = _parse_tool_call(response_str)
+    return isinstance(tool_call, dict) and bool(tool_call.get("tool_name"))
 
-    tool_selection_prompt = f"{SYSTEM_PROMPT_WITH_TOOLS}\n\nЗапрос пользователя:\n---\n{query}\n---\n\nТвой JSON с выбором инструмента:"
+
+async def _select_tool(query: str, llm_client: LLMClient, user_id: int) -> Optional[dict]:
+    tool_selection_prompt = f"Запрос пользователя:\n---\n{query}\n---\n\nТвой JSON с выбором инструмента:"
+    response_str = ""
     try:
-        response_str = await llm_client.generate_json_response(tool_selection_prompt)
-        json_start = response_str.find('{')
-        json_end = response_str.rfind('}')
-        if json_start == -1 or json_end == -1: raise ValueError("Не найден JSON в ответе LLM")
-        clean_json_str = response_str[json_start:json_end + 1]
-        tool_call = json.loads(clean_json_str)
-        tool_name = tool_call.get("tool_name")
-        parameters = tool_call.get("parameters", {})
+        # Системный промпт передается отдельным сообщением: его префикс Ollama берет из KV-кэша.
+        response_str = await llm_client.generate_json_response(tool_selection_prompt, use_case="tool_selection",
+                                                             user_id=user_id, system=SYSTEM_PROMPT_WITH_TOOLS,
+                                                             validate=_is_tool_call)
+        return _parse_tool_call(response_str)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка выбора инструмента для user_id={user_id}: {e}\nОтвет LLM: {response_str}")
-        return "К сожалению, я не смог понять ваш запрос. Попробуйте переформулировать."
+        return None
+
+
+async def _answer_with_llm(prompt: str, llm_client: LLMClient, user_id: int, stream: bool) -> AsyncIterator[str]:
+    if stream:
+        async for chunk in llm_client.stream_response(prompt, use_case="rag_answer", user_id=user_id):
+            yield chunk
+    else:
+        yield await llm_client.generate_text(prompt, use_case="rag_answer", user_id=user_id)
+
+
+async def _search_knowledge_base(rag_query: str, collection, llm_client: LLMClient, user_id: int,
+                                 stream: bool) -> AsyncIterator[str]:
+    chunks = await retrieve_context(rag_query, collection)
+
+    if not chunks:
+        logger.info("RAG: релевантный контекст не найден. Возврат к общим знаниям LLM.")
+
+        final_prompt = f"Ответь на вопрос пользователя кратко и понятно, СТРОГО на русском языке, как если бы ты был SMM-экспертом. Вопрос: '{rag_query}'"
+    else:
+        logger.info(f"RAG: ответ на основе {len(chunks)} фрагментов контекста.")
+        context = "\n---\n".join(chunk.text for chunk in chunks)
+        final_prompt = f"Ты должен ответить на вопрос пользователя, основываясь ИСКЛЮЧИТЕЛЬНО на предоставленном ниже КОНТЕКСТЕ.\nКОНТЕКСТ:\n---\n{context}\n---\nВОПРОС: '{rag_query}'"
+
+    async for chunk in _answer_with_llm(final_prompt, llm_client, user_id, stream):
+        yield chunk
+
+
+async def _execute_tool(tool_name: str, parameters: dict, llm_client: LLMClient, user_id: int,
+                        stream: bool) -> AsyncIterator[str]:
+    if tool_name == "greet":
+        yield SMALL_TALK_PHRASES.get("привет")
+    elif tool_name == "generate_promo":
+        promo_request_data = promo_schema.PromoRequest(**parameters)
+        posts = await promo_service.generate_promo_logic(request=promo_request_data, user_id=user_id)
+        yield "Готово! Вот несколько идей для постов:\n\n" + "\n".join(
+            [f"- {post}" for post in posts])
+    elif tool_name == "generate_document":
+        if 'details' not in parameters or not isinstance(parameters['details'], dict): parameters[
+            'details'] = {}
+        doc_request_data = document_schema.DocumentRequest(**parameters)
+        doc_text = await document_service.generate_document_logic(request=doc_request_data, user_id=user_id)
+        yield f"Документ '{parameters.get('template_name')}' готов! Текст ниже:\n\n---\n{doc_text}"
+    elif tool_name == "navigate_ui":
+        feature = parameters.get('feature_name', 'нужный раздел')
+        yield f"Чтобы найти '{feature}', просто перейдите в соответствующую вкладку в верхнем меню."
+
+    elif tool_name == "search_knowledge_base":
+        collection = await knowledge_base.aget_collection()
+        if collection is None:
+            yield "К сожалению, моя база знаний сейчас недоступна."
+        else:
+            rag_query = parameters.get("query")
+            if not rag_query:
+                yield "Пожалуйста, уточните, что именно вы хотите найти."
+            else:
+                async for chunk in _search_knowledge_base(rag_query, collection, llm_client, user_id, stream):
+                    yield chunk
+
+    elif tool_name == "unrelated_query":
+        yield RESPONSE_OUT_OF_TOPIC
+    elif tool_name == "clarify":
+        yield parameters.get("question", "Не могли бы вы уточнить ваш запрос?")
+    else:
+        logger.warning(f"Неизвестный инструмент '{tool_name}' выбран для user_id={user_id}")
+        yield "Я понял, что вы хотите сделать, но пока не умею выполнять такие действия."
+
+
+async def _bot_response_events(query: str, llm_client: LLMClient, user_id: int,
+                               stream: bool) -> AsyncIterator[StreamEvent]:
+    logger.info(f"Получен запрос от пользователя ID={user_id}: '{query}'")
+    normalized_query = query.strip().lower()
+
+    prefilter_reply = _prefilter_reply(normalized_query)
+    if prefilter_reply:
+        yield "done", {"reply": prefilter_reply}
+        return
+
+    tool_call = await intent_router.route(query) if settings.INTENT_ROUTER_ENABLED else None
+    if tool_call is not None:
+        logger.info(f"Инструмент для user_id={user_id} выбран локально, без LLM.")
+    else:
+        tool_call = await _select_tool(query, llm_client, user_id)
+    if tool_call is None:
+        yield "done", {"reply": "К сожалению, я не смог понять ваш запрос. Попробуйте переформулировать."}
+        return
+    tool_name = tool_call.get("tool_name")
+    parameters = tool_call.get("parameters", {})
 
     logger.info(f"Ассистент для user_id={user_id} выбрал инструмент: {tool_name} с параметрами: {parameters}")
 
-    async with AsyncSessionLocal() as db:
-        try:
-            final_response = ""
-            if tool_name == "greet":
-                final_response = SMALL_TALK_PHRASES.get("привет")
-            elif tool_name == "generate_promo":
-                promo_request_data = promo_schema.PromoRequest(**parameters)
-                posts = await promo_service.generate_promo_logic(request=promo_request_data, db=db, user_id=user_id)
-                final_response = "Готово! Вот несколько идей для постов:\n\n" + "\n".join(
-                    [f"- {post}" for post in posts])
-            elif tool_name == "generate_document":
-                if 'details' not in parameters or not isinstance(parameters['details'], dict): parameters[
-                    'details'] = {}
-                doc_request_data = document_schema.DocumentRequest(**parameters)
-                doc_text = await document_service.generate_document_logic(request=doc_request_data, db=db,
-                                                                          user_id=user_id)
-                final_response = f"Документ '{parameters.get('template_name')}' готов! Текст ниже:\n\n---\n{doc_text}"
-            elif tool_name == "navigate_ui":
-                feature = parameters.get('feature_name', 'нужный раздел')
-                final_response = f"Чтобы найти '{feature}', просто перейдите в соответствующую вкладку в верхнем меню."
-
-            elif tool_name == "search_knowledge_base":
-                if not RAG_ENABLED:
-                    final_response = "К сожалению, моя база знаний сейчас недоступна."
-                else:
-                    rag_query = parameters.get("query")
-                    if not rag_query:
-                        final_response = "Пожалуйста, уточните, что именно вы хотите найти."
-                    else:
-                        query_embedding = embedding_model.encode([rag_query])
-                        results = collection.query(query_embeddings=query_embedding.tolist(), n_results=1,
-                                                   include=["documents", "distances"])
-                        distance = results.get('distances', [[999]])[0][0]
-                        logger.info(f"RAG: Найден документ с евклидовым расстоянием (L2): {distance}")
-
-                        if not results.get('documents') or not results['documents'][
-                            0] or distance > L2_RELEVANCE_THRESHOLD:
-                            logger.info(
-                                f"RAG результат нерелевантен (расстояние {distance} > {L2_RELEVANCE_THRESHOLD}). Возврат к общим знаниям LLM.")
-
-                            final_prompt = f"Ответь на вопрос пользователя кратко и понятно, СТРОГО на русском языке, как если бы ты был SMM-экспертом. Вопрос: '{rag_query}'"
-
-                            response = await llm_client.client.generate(model=llm_client.model, prompt=final_prompt,
-                                                                        stream=False)
-                            final_response = response['response'].strip()
-                        else:
-                            logger.info("RAG результат релевантен. Ответ на основе контекста.")
-                            context = results['documents'][0][0]
-                            final_prompt = f"Ты должен ответить на вопрос пользователя, основываясь ИСКЛЮЧИТЕЛЬНО на предоставленном ниже КОНТЕКСТЕ.\nКОНТЕКСТ:\n---\n{context}\n---\nВОПРОС: '{rag_query}'"
-                            response = await llm_client.client.generate(model=llm_client.model, prompt=final_prompt,
-                                                                        stream=False)
-                            final_response = response['response'].strip()
-
-            elif tool_name == "unrelated_query":
-                final_response = RESPONSE_OUT_OF_TOPIC
-            elif tool_name == "clarify":
-                final_response = parameters.get("question", "Не могли бы вы уточнить ваш запрос?")
-            else:
-                logger.warning(f"Неизвестный инструмент '{tool_name}' выбран для user_id={user_id}")
-                final_response = "Я понял, что вы хотите сделать, но пока не умею выполнять такие действия."
-
-            return censor_output(final_response)
-        except ValidationError as e:
-            logger.warning(f"Ошибка валидации параметров от LLM для '{tool_name}': {e}")
-            return f"Я попытался использовать инструмент '{tool_name}', но мне не хватило данных. Не могли бы вы предоставить больше информации?"
-        except Exception as e:
-            logger.error(f"Ошибка выполнения инструмента '{tool_name}' для user_id={user_id}: {e}", exc_info=True)
-            return "К сожалению, при выполнении вашей команды произошла внутренняя ошибка."
+    parts, emitted = [], 0
+    try:
+        async with aclosing(_execute_tool(tool_name, parameters, llm_client, user_id, stream)) as chunks:
+            async for chunk in chunks:
+                parts.append(chunk)
+                text = "".join(parts)
+                # Проверка на утечку промпта идет по ходу потока: при срабатывании генерация
+                # прерывается, и клиент получает только замену в `done`.
+                if _has_prompt_leak(text):
+                    break
+                safe_end = len(text) - PROMPT_LEAK_HOLDBACK
+                if safe_end > emitted:
+                    yield "token", {"text": text[emitted:safe_end]}
+                    emitted = safe_end
+        text = "".join(parts)
+        final_response = censor_output(text.strip())
+        if final_response == text.strip() and emitted < len(text):
+            yield "token", {"text": text[emitted:]}
+    except HTTPException:
+        raise
+    except ValidationError as e:
+        logger.warning(f"Ошибка валидации параметров от LLM для '{tool_name}': {e}")
+        final_response = f"Я попытался использовать инструмент '{tool_name}', но мне не хватило данных. Не могли бы вы предоставить больше информации?"
+    except Exception as e:
+        logger.error(f"Ошибка выполнения инструмента '{tool_name}' для user_id={user_id}: {e}", exc_info=True)
+        final_response = "К сожалению, при выполнении вашей команды произошла внутренняя ошибка."
+
+    yield "done", {"reply": final_response}
+
+
+async def get_bot_response(query: str, llm_client: LLMClient, user_id: int) -> str:
+    reply = ""
+    async for event, data in _bot_response_events(query, llm_client, user_id, stream=False):
+        if event == "done":
+            reply = data["reply"]
+    return reply
+
+
+def stream_bot_response(query: str, llm_client: LLMClient, user_id: int) -> AsyncIterator[StreamEvent]:
+    """
+    Потоковый вариант `get_bot_response`. Ответ модели в режиме базы знаний
+    отдается событиями `token` по мере генерации, за вычетом короткого хвоста,
+    который придерживается до проверки на утечку промпта. Итоговый
+    (отцензурированный) ответ всегда приходит в событии `done` и является окончательным.
+    """
+    return _bot_response_events(query, llm_client, user_id, stream=True)
@@ -0,0 +1,163 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.services.embedding_service import knowledge_base, normalize_query
+
+
+@dataclass
+class RetrievedChunk:
+    text: str
+    source: Optional[str]
+    # Расстояние L2 до запроса; None — кандидат найден только лексическим поиском.
+    distance: Optional[float]
+    score: float
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов: для русского текста в среднем ~3 символа на токен."""
+    return len(text) // 3 + 1
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def mmr_select(embeddings: np.ndarray, relevance: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """
+    Maximal Marginal Relevance: на каждом шаге берет кандидата с лучшим
+    балансом между релевантностью и непохожестью на уже выбранные.
+    `relevance` — оценки кандидатов в шкале, сопоставимой с косинусной близостью.
+    """
+    if not len(relevance):
+        return []
+    vectors = _unit(np.asarray(embeddings, dtype=np.float32))
+
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(relevance)):
+        similarity_to_selected = (vectors @ vectors[selected].T).max(axis=1)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * similarity_to_selected
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+def pack_context(chunks: List[RetrievedChunk], token_budget: int) -> List[RetrievedChunk]:
+    """Жадно укладывает чанки (в порядке убывания ценности) в бюджет токенов промпта."""
+    packed, used = [], 0
+    for chunk in chunks:
+        tokens = estimate_tokens(chunk.text)
+        if used + tokens <= token_budget:
+            packed.append(chunk)
+            used += tokens
+        elif not packed:
+            # Даже лучший чанк не помещается целиком — берем его начало.
+            packed.append(RetrievedChunk(chunk.text[:token_budget * 3], chunk.source, chunk.distance, chunk.score))
+            break
+    return packed
+
+
+def _first_query(results: dict, key: str) -> list:
+    """Значения первого (единственного) запроса из ответа `collection.query`."""
+    values = _values(results, key)
+    return list(values[0]) if values and values[0] is not None else []
+
+
+def _values(results: dict, key: str) -> list:
+    # Новые версии ChromaDB возвращают эмбеддинги массивами numpy, поэтому без проверки на истинность.
+    values = results.get(key)
+    return [] if values is None else list(values)
+
+
+async def _exact_term_context(collection, term_ids: List[str]) -> List[RetrievedChunk]:
+    results = await knowledge_base.get_chunks(collection, term_ids, include=["documents", "metadatas"])
+    documents = _values(results, "documents")
+    metadatas = _values(results, "metadatas") or [None] * len(documents)
+    chunks = [RetrievedChunk(text, (metadata or {}).get("source"), 0.0, 1.0)
+              for text, metadata in zip(documents, metadatas)]
+    return pack_context(chunks, settings.RAG_CONTEXT_TOKEN_BUDGET)
+
+
+async def retrieve_context(query: str, collection) -> List[RetrievedChunk]:
+    """
+    Ищет контекст для ответа. Если запрос — точное название термина глоссария,
+    чанк берется из лексического индекса без вычисления эмбеддинга. Иначе
+    кандидаты — объединение top-k из ChromaDB (с отсевом по порогу L2) и top-k
+    по BM25; после удаления дубликатов они ранжируются суммой косинусной близости
+    и нормированного BM25 (или CrossEncoder, если он включен), отбираются по MMR
+    и упаковываются в бюджет токенов. Пустой список — релевантного контекста нет.
+    """
+    lexical_index = await knowledge_base.aget_lexical_index()
+    if lexical_index is not None:
+        term_ids = lexical_index.lookup_term(query)
+        if term_ids:
+            logger.info(f"RAG: точное совпадение с термином глоссария ({len(term_ids)} чанков), эмбеддинг не нужен.")
+            return await _exact_term_context(collection, term_ids)
+
+    query_embedding = await knowledge_base.embed(query)
+    results = await knowledge_base.query(
+        collection, query_embedding, n_results=settings.RAG_TOP_K,
+        include=["documents", "distances", "metadatas", "embeddings"],
+    )
+    ids = _first_query(results, "ids")
+    documents = _first_query(results, "documents")
+    distances = _first_query(results, "distances")
+    metadatas = _first_query(results, "metadatas") or [None] * len(documents)
+    embeddings = _first_query(results, "embeddings")
+
+    bm25_scores = {}
+    if lexical_index is not None:
+        bm25_scores = {doc_id: score for doc_id, score in lexical_index.search(query, settings.RAG_TOP_K)
+                       if score >= settings.RAG_BM25_MIN_SCORE}
+
+    pool = []
+    for doc_id, text, distance, metadata, embedding in zip(ids, documents, distances, metadatas, embeddings):
+        # Лексическое совпадение оставляет кандидата даже за порогом L2.
+        if distance <= settings.RAG_L2_RELEVANCE_THRESHOLD or doc_id in bm25_scores:
+            pool.append((doc_id, text, distance, metadata, embedding))
+
+    lexical_only = [doc_id for doc_id in bm25_scores if doc_id not in ids]
+    if lexical_only:
+        extra = await knowledge_base.get_chunks(collection, lexical_only,
+                                                include=["documents", "metadatas", "embeddings"])
+        extra_documents = _values(extra, "documents")
+        extra_metadatas = _values(extra, "metadatas") or [None] * len(extra_documents)
+        pool.extend(zip(_values(extra, "ids"), extra_documents, [None] * len(extra_documents),
+                        extra_metadatas, _values(extra, "embeddings")))
+
+    candidates, candidate_ids, vectors, seen = [], [], [], set()
+    for doc_id, text, distance, metadata, embedding in pool:
+        key = normalize_query(text)
+        if key in seen:
+            continue
+        seen.add(key)
+        candidates.append(RetrievedChunk(text, (metadata or {}).get("source"), distance, 0.0))
+        candidate_ids.append(doc_id)
+        vectors.append(embedding)
+
+    logger.info(f"RAG: {len(documents)} кандидатов по векторам (ближайшее L2 {distances[0] if distances else '-'}), "
+                f"{len(bm25_scores)} по BM25, после отсева {len(candidates)}.")
+    if not candidates:
+        return []
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rerank_scores = await knowledge_base.rerank(query, [chunk.text for chunk in candidates])
+    if rerank_scores is None:
+        relevance = _unit(vectors) @ _unit(np.asarray(query_embedding, dtype=np.float32))
+        if bm25_scores:
+            max_bm25 = max(bm25_scores.values())
+            lexical = np.array([bm25_scores.get(doc_id, 0.0) / max_bm25 for doc_id in candidate_ids])
+            relevance = relevance + settings.RAG_LEXICAL_WEIGHT * lexical
+    else:
+        # CrossEncoder возвращает логиты; сигмоида переводит их в [0, 1], как и косинус для MMR.
+        relevance = 1 / (1 + np.exp(-rerank_scores))
+    for chunk, score in zip(candidates, relevance):
+        chunk.score = float(score)
+
+    order = mmr_select(vectors, np.asarray(relevance, dtype=np.float32),
+                       settings.RAG_CONTEXT_CHUNKS, settings.RAG_MMR_LAMBDA)
+    return pack_context([candidates[i] for i in order], settings.RAG_CONTEXT_TOKEN_BUDGET)
@@ -0,0 +1,40 @@
+"""
+Отдельный процесс-воркер очереди аналитики.
+
+Запуск: `python -m app.worker`. При использовании выделенных воркеров
+в API-процессах можно выставить ANALYTICS_EMBEDDED_WORKERS=0.
+"""
+import asyncio
+import sys
+
+from loguru import logger
+
+from app.core.config import settings
+from app.database import engine, Base, create_missing_indexes
+from app.services.analytics_worker import AnalyticsWorkerPool
+from app.services.history_writer import history_writer
+from app import models
+
+
+async def main():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_missing_indexes)
+
+    await history_writer.start()
+    pool = AnalyticsWorkerPool(concurrency=settings.ANALYTICS_WORKER_CONCURRENCY)
+    pool.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+        await history_writer.stop()
+
+
+if __name__ == "__main__":
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
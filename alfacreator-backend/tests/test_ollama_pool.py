@@ -0,0 +1,167 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.core.ollama_pool import OllamaPool
+
+HOST_A = "http://ollama-a:11434"
+HOST_B = "http://ollama-b:11434"
+
+
+class StubOllama:
+    """
+    Заглушки двух серверов Ollama на одном httpx.MockTransport.
+    Поведение узла задается функцией `handlers[host](request)`; по умолчанию узел отвечает своим именем.
+    """
+    def __init__(self):
+        self.handlers = {}
+        self.requests = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        self.requests.append((host, request.url.path))
+        handler = self.handlers.get(host)
+        if handler is not None:
+            return await handler(request)
+        return self.reply(host)
+
+    @staticmethod
+    def reply(text: str) -> httpx.Response:
+        return httpx.Response(200, json={"model": "stub", "response": text, "done": True})
+
+    def hosts_for(self, path: str):
+        return [host for host, request_path in self.requests if request_path == path]
+
+
+def stream_body(*texts: str, fail_after: bool = False):
+    async def body():
+        for text in texts:
+            yield (json.dumps({"model": "stub", "response": text, "done": False}) + "\n").encode()
+        if fail_after:
+            raise httpx.ReadError("соединение оборвано")
+        yield (json.dumps({"model": "stub", "response": "", "done": True}) + "\n").encode()
+    return body()
+
+
+async def connection_refused(request: httpx.Request) -> httpx.Response:
+    raise httpx.ConnectError("connection refused", request=request)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def stub():
+    return StubOllama()
+
+
+@pytest.fixture
+def pool(stub):
+    return OllamaPool([HOST_A, HOST_B], health_check_interval=0.01, health_check_timeout=1,
+                      transport=httpx.MockTransport(stub))
+
+
+def generate(client):
+    return client.generate(model="stub", prompt="привет")
+
+
+def generate_stream(client):
+    return client.generate(model="stub", prompt="привет", stream=True)
+
+
+async def collect(pool):
+    return [part["response"] async for part in pool.stream(generate_stream)]
+
+
+@pytest.mark.anyio
+async def test_call_picks_node_with_fewest_outstanding_requests(pool, stub):
+    release = asyncio.Event()
+
+    async def slow(request):
+        await release.wait()
+        return stub.reply("ollama-a")
+
+    stub.handlers["ollama-a"] = slow
+    first = asyncio.create_task(pool.call(generate))
+    await asyncio.sleep(0.01)
+    # Узел A занят первым запросом, поэтому второй уходит на B.
+    second = await pool.call(generate)
+    release.set()
+
+    assert second["response"] == "ollama-b"
+    assert (await first)["response"] == "ollama-a"
+    assert [node.outstanding for node in pool.nodes] == [0, 0]
+
+
+@pytest.mark.anyio
+async def test_call_fails_over_on_transport_error(pool, stub):
+    stub.handlers["ollama-a"] = connection_refused
+
+    response = await pool.call(generate)
+
+    assert response["response"] == "ollama-b"
+    assert [node.healthy for node in pool.nodes] == [False, True]
+    # Недоступный узел больше не выбирается, пока его не вернет проверка здоровья.
+    await pool.call(generate)
+    assert stub.hosts_for("/api/generate") == ["ollama-a", "ollama-b", "ollama-b"]
+
+
+@pytest.mark.anyio
+async def test_call_raises_when_all_nodes_are_down(pool, stub):
+    stub.handlers["ollama-a"] = connection_refused
+    stub.handlers["ollama-b"] = connection_refused
+
+    with pytest.raises(ConnectionError):
+        await pool.call(generate)
+
+
+@pytest.mark.anyio
+async def test_stream_retries_on_other_node_before_first_chunk(pool, stub):
+    stub.handlers["ollama-a"] = connection_refused
+
+    async def streaming(request):
+        return httpx.Response(200, content=stream_body("При", "вет"))
+
+    stub.handlers["ollama-b"] = streaming
+
+    assert "".join(await collect(pool)) == "Привет"
+    assert stub.hosts_for("/api/generate") == ["ollama-a", "ollama-b"]
+
+
+@pytest.mark.anyio
+async def test_stream_is_not_retried_after_first_chunk(pool, stub):
+    async def broken_stream(request):
+        return httpx.Response(200, content=stream_body("При", fail_after=True))
+
+    stub.handlers["ollama-a"] = broken_stream
+
+    parts = []
+    with pytest.raises(httpx.TransportError):
+        async for part in pool.stream(generate_stream):
+            parts.append(part["response"])
+
+    assert parts == ["При"]
+    assert stub.hosts_for("/api/generate") == ["ollama-a"]
+    assert pool.nodes[0].healthy is False
+
+
+@pytest.mark.anyio
+async def test_health_check_restores_and_excludes_nodes(pool, stub):
+    pool.nodes[0].healthy = False
+
+    async def tags_failing(request):
+        return httpx.Response(500)
+
+    stub.handlers["ollama-b"] = tags_failing
+    pool.start_health_checks()
+    try:
+        await asyncio.sleep(0.05)
+    finally:
+        await pool.stop_health_checks()
+
+    assert [node.healthy for node in pool.nodes] == [True, False]
+    assert set(stub.hosts_for("/api/tags")) == {"ollama-a", "ollama-b"}
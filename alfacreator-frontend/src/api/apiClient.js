@@ -39,6 +39,18 @@ export const getHistory = (type) => {
   return apiClient.get(`/history/?request_type=${type}`);
 };
 
+export const getHistoryEntry = (id) => apiClient.get(`/history/${id}`);
+
+/**
+ * Крупные input_data/output_data в списке истории заменены заглушкой { $payload, size };
+ * полностью такая запись загружается через getHistoryEntry.
+ */
+export const isHistoryItemOffloaded = (item) =>
+  ['input_data', 'output_data'].some((field) => Boolean(item[field] && item[field].$payload));
+
+export const offloadedSizeKb = (item) =>
+  Math.ceil(['input_data', 'output_data'].reduce((sum, field) => sum + ((item[field] && item[field].size) || 0), 0) / 1024);
+
 export const registerUser = (email, password) => {
   return apiClient.post('/auth/register', { email, password });
 };
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
-import { getHistory } from '../api/apiClient';
+import { getHistory, getHistoryEntry, isHistoryItemOffloaded, offloadedSizeKb } from '../api/apiClient';
+import toast from 'react-hot-toast';
 import Loader from '../components/Loader';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 
@@ -58,7 +59,26 @@ const HistoryPage = () => {
     fetchHistory();
   }, []);
 
+  const openEntry = async (id) => {
+    try {
+      const response = await getHistoryEntry(id);
+      setHistory((items) => items.map((item) => (item.id === id ? response.data : item)));
+    } catch (error) {
+      toast.error("Не удалось загрузить запись истории.");
+    }
+  };
+
   const renderItem = (item) => {
+    if (isHistoryItemOffloaded(item)) {
+      return (
+        <button
+          onClick={() => openEntry(item.id)}
+          className="text-sm font-semibold text-red-600 hover:underline"
+        >
+          Показать результат ({offloadedSizeKb(item)} КБ)
+        </button>
+      );
+    }
     switch (item.request_type) {
       case 'promo': return <PromoHistoryItem item={item} />;
       case 'analytics': return <AnalyticsHistoryItem item={item} />;
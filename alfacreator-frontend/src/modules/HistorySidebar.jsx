@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { getHistory } from '../api/apiClient';
+import { getHistory, getHistoryEntry, isHistoryItemOffloaded, offloadedSizeKb } from '../api/apiClient';
 import toast from 'react-hot-toast';
 import Loader from '../components/Loader';
 
@@ -37,6 +37,12 @@ const SmartAnalyticsHistoryItem = ({ item }) => (
     </>
 );
 
+const OffloadedHistoryItem = ({ item }) => (
+  <p className="text-sm text-gray-500 italic">
+    Большой результат ({offloadedSizeKb(item)} КБ) — нажмите, чтобы открыть
+  </p>
+);
+
 
 const HistorySidebar = ({ type, refreshKey, onItemClick }) => {
   const [history, setHistory] = useState([]);
@@ -57,7 +63,21 @@ const HistorySidebar = ({ type, refreshKey, onItemClick }) => {
     fetchHistory();
   }, [type, refreshKey]);
 
+  const handleItemClick = async (item) => {
+    if (!isHistoryItemOffloaded(item)) {
+      onItemClick(item);
+      return;
+    }
+    try {
+      const response = await getHistoryEntry(item.id);
+      onItemClick(response.data);
+    } catch (error) {
+      toast.error('Не удалось загрузить запись истории');
+    }
+  };
+
   const renderItem = (item) => {
+    if (isHistoryItemOffloaded(item)) return <OffloadedHistoryItem item={item} />;
     switch (item.request_type) {
       case 'promo': return <PromoHistoryItem item={item} />;
       case 'analytics': return <AnalyticsHistoryItem item={item} />;
@@ -78,7 +98,7 @@ const HistorySidebar = ({ type, refreshKey, onItemClick }) => {
             <div
               key={item.id}
               className="bg-white p-3 rounded-lg shadow-sm border hover:shadow-md hover:border-red-300 transition-all cursor-pointer"
-              onClick={() => onItemClick(item)}
+              onClick={() => handleItemClick(item)}
             >
               <span className="text-xs text-gray-400 float-right">{new Date(item.created_at).toLocaleDateString('ru-RU')}</span>
               {renderItem(item)}